@@ -2,7 +2,7 @@ from __future__ import annotations
 from threading import Lock
 from logging import Logger
 
-import requests
+from usbipice.utils import get_transport
 
 class ConnectionInfo:
     """Database for information required to establish and maintain usbip connections."""
@@ -24,6 +24,7 @@ class BaseAPI:
         self.connection_info = {}
         self.lock = Lock()
         self.logger = logger
+        self.transport = get_transport()
 
     def addSerial(self, serial, conn_info: ConnectionInfo):
         with self.lock:
@@ -59,9 +60,9 @@ class BaseAPI:
         is instead sent as a multipart forum."""
         try:
             if files:
-                res = requests.get(f"{url}/{endpoint}", data=json, files=files, timeout=20)
+                res = self.transport.get(f"{url}/{endpoint}", data=json, files=files, timeout=20)
             else:
-                res = requests.get(f"{url}/{endpoint}", json=json, timeout=20)
+                res = self.transport.get(f"{url}/{endpoint}", json=json, timeout=20)
 
             if res.status_code != 200:
                 self.logger.error(f"failed to GET /{endpoint}")
@@ -85,8 +86,10 @@ class BaseAPI:
 
         return self.request(conn_info.url(), endpoint, json, files=files)
 
-    def reserve(self, amount: int, kind: str, args: dict) -> dict:
-        """Reserves amount devices with subscription_url as a event server.
+    def reserve(self, amount: int, kind: str, args: dict, placement: str=None, worker: str=None) -> dict:
+        """Reserves amount devices with subscription_url as a event server. Placement selects how devices
+        are chosen across workers: any (default), pack (as few workers as possible), spread (one device per
+        worker in turn) or worker (devices on worker first, then packed).
         Returns successful reservations as a dict of serial -> bus"""
         json = {
             "amount": amount,
@@ -95,6 +98,12 @@ class BaseAPI:
             "args": args
         }
 
+        if placement:
+            json["placement"] = placement
+
+        if worker:
+            json["worker"] = worker
+
         data = self.requestControl("reserve", json)
 
         if data is False:
@@ -111,6 +120,37 @@ class BaseAPI:
 
         return out
 
+    def reserveQueued(self, amount: int, kind: str, args: dict, timeout: int=3600, priority: int=0,
+                      placement: str=None, worker: str=None) -> str:
+        """Queues a reservation for amount devices that is filled as devices become available, instead of
+        failing when too few are free. Tickets with a higher priority are served first. Devices that have not
+        been assigned after timeout seconds are given up on. Assigned devices are sent to the client as
+        'reservation assigned' events. Returns the ticket id."""
+        json = {
+            "amount": amount,
+            "name": self.name,
+            "kind": kind,
+            "args": args,
+            "timeout": timeout,
+            "priority": priority
+        }
+
+        if placement:
+            json["placement"] = placement
+
+        if worker:
+            json["worker"] = worker
+
+        return self.requestControl("reservequeue", json)
+
+    def cancelQueued(self, ticket: str) -> bool:
+        """Stops a queued reservation from receiving more devices. Devices that were already assigned
+        remain reserved. Returns whether the ticket was still waiting."""
+        return bool(self.requestControl("cancelqueue", {
+            "name": self.name,
+            "ticket": ticket
+        }))
+
     def extend(self, serials: list[str]) -> list[str]:
         """Extends the reservation on serials for by hour. The serials must be reserved under the client's name.
         Returns the serials that were extended."""
@@ -5,6 +5,7 @@ from itertools import groupby
 import threading
 
 from usbipice.client.lib import BaseAPI, EventServer, AbstractEventHandler, register
+from usbipice.client.lib.BaseAPI import ConnectionInfo
 
 class BaseClientEventHandler(AbstractEventHandler):
     """Updates the available serials of a client. Provides initialization
@@ -17,6 +18,10 @@ class BaseClientEventHandler(AbstractEventHandler):
         self.awaiting_serials = set()
         self.cond = threading.Condition()
 
+        self.assigned: dict[str, list[str]] = {}
+        self.expired: set[str] = set()
+        self.assigned_cond = threading.Condition()
+
     @register("reservation end", "serial")
     def handleReservationEnd(self, serial: str):
         self.client.removeSerial(serial)
@@ -25,6 +30,45 @@ class BaseClientEventHandler(AbstractEventHandler):
     def handleFailure(self, serial: str):
         self.client.removeSerial(serial)
 
+    @register("missed events", "serial", "missed")
+    def handleMissedEvents(self, serial: str, missed: int):
+        self.client.logger.warning(f"missed {missed} events for {serial} while disconnected")
+
+    @register("reservation assigned", "serial", "ticket", "ip", "serverport")
+    def handleReservationAssigned(self, serial: str, ticket: str, ip: str, serverport: int):
+        info = ConnectionInfo(ip, serverport)
+        self.client.addSerial(serial, info)
+
+        # connecting can take seconds, which would hold up the later events of the control socket
+        threading.Thread(target=self.__connectAssigned, args=(serial, ticket, info), daemon=True,
+                         name=f"connect-{serial}").start()
+
+    def __connectAssigned(self, serial: str, ticket: str, info: ConnectionInfo):
+        try:
+            self.client.server.connectWorker(info.url())
+        except Exception as e:
+            self.client.logger.error(f"failed to connect to worker {info.url()} for {serial}: {e}")
+
+        with self.assigned_cond:
+            self.assigned.setdefault(ticket, []).append(serial)
+            self.assigned_cond.notify_all()
+
+    @register("ticket expired", "ticket", "remaining")
+    def handleTicketExpired(self, ticket: str, remaining: int):
+        self.client.logger.warning(f"queued reservation {ticket} expired with {remaining} devices unassigned")
+
+        with self.assigned_cond:
+            self.expired.add(ticket)
+            self.assigned_cond.notify_all()
+
+    def waitUntilAssigned(self, ticket: str, amount: int, timeout: float=None) -> list[str]:
+        """Waits until amount devices have been assigned to ticket, the ticket expires or timeout
+        seconds pass. Returns the serials assigned so far."""
+        with self.assigned_cond:
+            self.assigned_cond.wait_for(lambda : len(self.assigned.get(ticket, [])) >= amount or ticket in self.expired,
+                                        timeout=timeout)
+            return list(self.assigned.get(ticket, []))
+
     @register("initialized", "serial")
     def handleInitialization(self, serial):
         with self.cond:
@@ -58,9 +102,9 @@ class BaseClient(BaseAPI):
     def addEventHandler(self, eh: AbstractEventHandler):
         self.server.addEventHandler(eh)
 
-    def reserve(self, amount: int, kind: str, args: str):
+    def reserve(self, amount: int, kind: str, args: str, placement: str=None, worker: str=None):
         with self.reservation_lock:
-            serials = super().reserve(amount, kind, args)
+            serials = super().reserve(amount, kind, args, placement=placement, worker=worker)
 
             if not serials:
                 return serials
@@ -79,6 +123,12 @@ class BaseClient(BaseAPI):
             self.eh.waitUntilInitilized(connected)
             return connected
 
+    def waitQueued(self, ticket: str, amount: int, timeout: float=None) -> list[str]:
+        """Waits until amount devices have been assigned to a queued reservation (see reserveQueued),
+        the reservation expires or timeout seconds pass. Assigned devices are connected as they arrive.
+        Returns the serials assigned so far."""
+        return self.eh.waitUntilAssigned(ticket, amount, timeout=timeout)
+
     def removeSerial(self, serial):
         conn_info = self.getConnectionInfo(serial)
         super().removeSerial(serial)
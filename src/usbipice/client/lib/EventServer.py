@@ -5,6 +5,8 @@ import json
 
 import socketio
 
+from usbipice.utils.compression import compress_payload
+
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from usbipice.client.lib import AbstractEventHandler
@@ -27,9 +29,137 @@ class Event:
         self.event = event
         self.contents = contents
 
+# seconds that events after a gap are held, waiting for the missing events, before they are treated as lost
+EVENT_GAP_SECONDS = 1.0
+
+class EventOrder:
+    """Hands the events of a socket to dispatch one at a time, in seq order. The socket.io client
+    handles each frame on its own thread, so frames may be handled out of order: events after a gap
+    are held until the gap is filled or EVENT_GAP_SECONDS pass. After connecting, numbered events are
+    held until the session event tells which seq the connection starts at. ack is called with the seq
+    of the last handled event."""
+    def __init__(self, dispatch, ack, logger, resume: dict=None):
+        self.dispatch = dispatch
+        self.ack = ack
+        self.logger = logger
+
+        # held while dispatching, so events of the socket are handled one at a time
+        self.lock = threading.Lock()
+        self.session = resume["session"] if resume else None
+        # seq of the last handled event
+        self.watermark = resume["seq"] if resume else None
+        self.awaiting_session = True
+        # seq -> event waiting for the events before it
+        self.pending: dict[int, dict] = {}
+        self.timer: threading.Timer = None
+
+    def resume(self) -> dict:
+        """Returns the {session, seq} of the last handled event, or None."""
+        with self.lock:
+            if self.session is None or self.watermark is None:
+                return None
+
+            return {"session": self.session, "seq": self.watermark}
+
+    def reset(self):
+        """Called when the socket disconnects. Held events are dropped, the server resends them
+        since they were not acknowledged."""
+        with self.lock:
+            self.awaiting_session = True
+            self.pending.clear()
+            self.__cancelTimer()
+
+    def setSession(self, session: str, seq: int):
+        """Handles the session event, seq is the last event the server sent before this connection."""
+        with self.lock:
+            if self.session != session:
+                if self.session is not None:
+                    self.logger.warning("event session restarted, events sent before the restart may have been missed")
+
+                self.session = session
+                self.watermark = seq
+
+            self.awaiting_session = False
+            acked = self.__drain()
+
+        self.__ack(acked)
+
+    def receive(self, msgs: list[dict]):
+        """Handles the events of a frame."""
+        with self.lock:
+            numbered = False
+
+            for msg in msgs:
+                seq = msg.get("seq")
+
+                # servers that do not number events do not resume either
+                if not isinstance(seq, int):
+                    self.dispatch(msg)
+                    continue
+
+                numbered = True
+
+                if not self.awaiting_session and seq <= self.watermark:
+                    self.logger.debug(f"skipping already handled event {seq}")
+                    continue
+
+                self.pending[seq] = msg
+
+            acked = None
+            if numbered and not self.awaiting_session:
+                acked = self.__drain()
+
+        self.__ack(acked)
+
+    def __drain(self) -> int:
+        """Dispatches the held events that follow the watermark. Returns the seq to acknowledge.
+        Should be called with the lock held."""
+        for seq in [seq for seq in self.pending if seq <= self.watermark]:
+            del self.pending[seq]
+
+        while (msg := self.pending.pop(self.watermark + 1, None)) is not None:
+            self.watermark += 1
+            self.dispatch(msg)
+
+        if self.pending:
+            if not self.timer:
+                self.timer = threading.Timer(EVENT_GAP_SECONDS, self.__skipGap)
+                self.timer.daemon = True
+                self.timer.start()
+        else:
+            self.__cancelTimer()
+
+        return self.watermark
+
+    def __skipGap(self):
+        with self.lock:
+            self.timer = None
+
+            if self.awaiting_session or not self.pending:
+                return
+
+            lowest = min(self.pending)
+            self.logger.warning(f"missed {lowest - self.watermark - 1} events")
+            self.watermark = lowest - 1
+
+            acked = self.__drain()
+
+        self.__ack(acked)
+
+    def __cancelTimer(self):
+        """Should be called with the lock held."""
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def __ack(self, seq: int):
+        if seq is not None:
+            self.ack(seq)
+
 class EventServer:
     """Hosts a server for the workers and heartbeat process to send events to. When an event is received,
-    it calls the corresponding method of the EventHandlers starting at the 0 index."""
+    it calls the corresponding method of the EventHandlers starting at the 0 index. Handled events are
+    acknowledged, and reconnecting sockets resume after the last handled event."""
     def __init__(self, client_id, eventhandlers: list[AbstractEventHandler], logger):
         self.client_id = client_id
         self.logger = EventLogger(logger)
@@ -41,6 +171,13 @@ class EventServer:
         self.control_lock = threading.Lock()
         self.control_socket = None
 
+        # url -> compression accepted by the server
+        self.compression: dict[str, str] = {}
+
+        # url -> event order of the socket, which remembers the last handled event
+        self.order_lock = threading.Lock()
+        self.orders: dict[str, EventOrder] = {}
+
     def addEventHandler(self, eh: AbstractEventHandler):
         """Adds an event handler. Should not be called after reservations have
         been made."""
@@ -64,14 +201,31 @@ class EventServer:
         @sio.event
         def disconnect(reason):
             logger.error(f"disconnected: {reason}")
+            order.reset()
+
+        def auth():
+            auth = {"client_id": self.client_id, "batch": True, "compression": ["zlib"]}
+            if resume := order.resume():
+                auth["resume"] = resume
+
+            return auth
+
         @sio.event
-        def event(data):
-            try:
-                msg = json.loads(data)
-            except Exception:
-                logger.error("received unparsable data")
+        def compression(data):
+            if data == "zlib":
+                logger.info("server accepts zlib compression")
+                with self.worker_lock:
+                    self.compression[url] = data
+
+        @sio.event
+        def session(data):
+            if not isinstance(data, dict) or not data.get("session") or not isinstance(data.get("seq"), int):
+                logger.error("bad session")
                 return
 
+            order.setSession(data["session"], data["seq"])
+
+        def dispatch(msg: dict):
             serial = msg.get("serial")
             contents = msg.get("contents")
 
@@ -80,17 +234,65 @@ class EventServer:
             else:
                 event = None
 
-            if not serial or not event or not contents:
+            # events about the client rather than a device, such as ticket expired, have no serial
+            if not event or not contents:
                 logger.error("bad event contents")
                 return
 
             logger.debug(f"received {event} event")
             event = Event(serial, event, contents)
-            self.handleEvent(event)
+
+            try:
+                self.handleEvent(event)
+            except Exception as e:
+                logger.error(f"event handler failed: {e}")
+
+        def ack(seq):
+            try:
+                sio.emit("ack", seq)
+            except Exception:
+                logger.warning(f"failed to acknowledge event {seq}")
+
+        with self.order_lock:
+            previous = self.orders.get(url)
+            order = EventOrder(dispatch, ack, logger, previous.resume() if previous else None)
+            self.orders[url] = order
+
+        @sio.event
+        def event(data):
+            try:
+                msg = json.loads(data)
+            except Exception:
+                logger.error("received unparsable data")
+                return
+
+            if not isinstance(msg, dict):
+                logger.error("bad event contents")
+                return
+
+            order.receive([msg])
+
+        @sio.event
+        def events(data):
+            try:
+                msgs = json.loads(data)
+            except Exception:
+                logger.error("received unparsable data")
+                return
+
+            if not isinstance(msgs, list):
+                logger.error("bad event batch")
+                return
+
+            if not all(isinstance(msg, dict) for msg in msgs):
+                logger.error("bad event contents")
+                msgs = [msg for msg in msgs if isinstance(msg, dict)]
+
+            order.receive(msgs)
 
         # TODO
         try:
-            sio.connect(url, auth={"client_id": self.client_id}, wait_timeout=10)
+            sio.connect(url, auth=auth, wait_timeout=10)
             return sio
         except Exception:
             return False
@@ -105,12 +307,14 @@ class EventServer:
             self.worker_sockets[url] = self.__createSocket(url)
 
     def sendWorker(self, url, event, data: dict):
-        """Sends data to worker socket."""
-        try:
-            data = json.dumps(data)
-        except Exception:
-            self.logger.error(f"failed to jsonify event {event} for worker {url}")
-            return
+        """Sends data to worker socket. Bytes in data are sent as binary attachments, compressed
+        if the worker accepts it."""
+        with self.worker_lock:
+            compression = self.compression.get(url)
+
+        # compressed outside of the lock, other workers are not held up
+        if compression == "zlib":
+            data = compress_payload(data)
 
         with self.worker_lock:
             sio = self.worker_sockets.get(url)
@@ -118,7 +322,11 @@ class EventServer:
             if not sio:
                 return False
 
-            sio.emit(event, data)
+            try:
+                sio.emit(event, data)
+            except Exception as e:
+                self.logger.error(f"failed to send event {event} to worker {url}: {e}")
+                return False
 
             return True
 
@@ -136,6 +344,7 @@ class EventServer:
             sio.disconnect()
 
             del self.worker_sockets[url]
+            self.compression.pop(url, None)
 
     def exit(self):
         for eh in self.eventhandlers:
@@ -1,9 +1,18 @@
 from __future__ import annotations
+import hashlib
+import os
+import threading
 import uuid
+from logging import Logger
 from typing import List
 
 from usbipice.client.lib import AbstractEventHandler, register, BaseClient
 
+# bitstreams are streamed to workers in chunks of at most this many bytes
+UPLOAD_CHUNK_BYTES = 256 * 1024
+# missing bitstreams reported within this many seconds are uploaded together
+RESEND_DELAY_SECONDS = 0.5
+
 class PulseCountEventHandler(AbstractEventHandler):
     @register("results", "serial", "results")
     def results(self, serial: str, results: dict[str, int]):
@@ -11,19 +20,210 @@ class PulseCountEventHandler(AbstractEventHandler):
         from the file parameter used in the request body to the
         pulse amount."""
 
+class BitstreamUploadHandler(PulseCountEventHandler):
+    """Uploads bitstreams again when a worker no longer has them stored."""
+    def __init__(self, event_server, client: PulseCountBaseClient):
+        super().__init__(event_server)
+        self.client = client
+
+    @register("missing bitstreams", "serial", "hashes")
+    def missingBitstreams(self, serial: str, hashes: list[str]):
+        self.client.logger.warning(f"{serial} is missing bitstreams {hashes}, uploading them")
+        self.client.resendBitstreams(serial, hashes)
+
+    @register("results", "serial", "results")
+    def results(self, serial: str, results: dict[str, int]):
+        self.client.evaluated(serial, list(results.keys()))
+
 class PulseCountBaseClient(BaseClient):
-    def reserve(self, amount):
-        return super().reserve(amount, "pulsecount", {})
+    def __init__(self, url: str, client_name: str, logger: Logger):
+        super().__init__(url, client_name, logger)
+        self.addEventHandler(BitstreamUploadHandler(self.server, self))
+
+        # serial -> identifier -> (path, digest) of bitstreams sent to it that have no results and were not resent
+        self.sent_lock = threading.Lock()
+        self.sent: dict[str, dict[str, tuple[str, str]]] = {}
+        # serial -> identifier -> (path, digest) of bitstreams waiting to be resent
+        self.resends: dict[str, dict[str, tuple[str, str]]] = {}
+        self.resend_timer: threading.Timer = None
+
+    def reserve(self, amount, placement: str=None, worker: str=None):
+        return super().reserve(amount, "pulsecount", {}, placement=placement, worker=worker)
 
     def evaluate(self, serials: List[str], bitstreams: dict[uuid.UUID, str]) -> List[str]:
         """Queues bitstreams for evaluations on devices serials. Identifiers are used when
-        sending back the results - these should be unique and not reused."""
+        sending back the results - these should be unique and not reused. Bitstreams are
+        referenced by their sha256 and streamed to each worker in chunks, only those the
+        worker does not have stored are uploaded. Devices start evaluating while later
+        bitstreams are still being sent. Returns serials that the request could not be sent to."""
+        bitstreams = {str(iden): path for iden, path in bitstreams.items()}
+        digests = {iden: self.__digest(path) for iden, path in bitstreams.items()}
+
+        with self.sent_lock:
+            for serial in serials:
+                # earlier evaluations may still be in flight
+                self.sent.setdefault(serial, {}).update({iden: (path, digests[iden]) for iden, path in bitstreams.items()})
+
+        groups: dict[str, list[str]] = {}
+        failed = []
+        for serial in serials:
+            if not (info := self.getConnectionInfo(serial)):
+                self.logger.error(f"Could not get connection info for serial {serial}")
+                failed.append(serial)
+                continue
+
+            groups.setdefault(info.url(), []).append(serial)
+
+        for url, group in groups.items():
+            missing = self.request(url, "missingbitstreams", {"hashes": list(set(digests.values()))})
 
+            if missing is False:
+                # worker without a bitstream store
+                failed.extend(self.requestBatchWorker(group, "evaluate", {"files": self.__read(bitstreams)}))
+                continue
+
+            if not self.__stream(url, group, bitstreams, digests, set(missing)):
+                self.logger.error(f"Failed to stream bitstreams to worker {url} for serials {group}")
+                failed.extend(group)
+
+        return failed
+
+    def __digest(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(UPLOAD_CHUNK_BYTES):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def __read(self, bitstreams: dict[str, str]) -> dict[str, bytes]:
         files = {}
         for iden, path in bitstreams.items():
             with open(path, "rb") as f:
-                files[str(iden)] = f.read().decode("cp437")
+                files[iden] = f.read()
+
+        return files
 
-        return self.requestBatchWorker(serials, "evaluate", {
-            "files": files
+    def __stream(self, url: str, serials: list[str], bitstreams: dict[str, str], digests: dict[str, str],
+                 missing: set[str]) -> bool:
+        """Sends bitstreams to a worker as a batch: a chunk event for each part of a missing bitstream,
+        a chunk event without data for the others, followed by a commit with the amount of bitstreams.
+        Only one chunk is read into memory at a time. If sending fails, the batch is aborted so that the
+        devices do not hold back their results."""
+        batch = uuid.uuid4().hex
+
+        try:
+            sent = self.__sendBatch(url, serials, batch, bitstreams, digests, missing)
+        except OSError as e:
+            self.logger.error(f"Failed to read bitstreams: {e}")
+            sent = False
+
+        if not sent:
+            self.server.sendWorker(url, "batch abort", {"serial": serials, "batch": batch})
+
+        return sent
+
+    def __sendBatch(self, url: str, serials: list[str], batch: str, bitstreams: dict[str, str],
+                    digests: dict[str, str], missing: set[str]) -> bool:
+        uploaded = set()
+
+        for iden, path in bitstreams.items():
+            digest = digests[iden]
+            chunk = {
+                "serial": serials,
+                "batch": batch,
+                "name": iden,
+                "digest": digest,
+                "size": os.path.getsize(path)
+            }
+
+            if digest not in missing or digest in uploaded:
+                if not self.server.sendWorker(url, "batch chunk", chunk):
+                    return False
+                continue
+
+            uploaded.add(digest)
+
+            with open(path, "rb") as f:
+                offset = 0
+                while data := f.read(UPLOAD_CHUNK_BYTES):
+                    if not self.server.sendWorker(url, "batch chunk", {**chunk, "offset": offset, "data": data}):
+                        return False
+                    offset += len(data)
+
+        return self.server.sendWorker(url, "batch commit", {
+            "serial": serials,
+            "batch": batch,
+            "count": len(bitstreams)
         })
+
+    def removeSerial(self, serial):
+        with self.sent_lock:
+            self.sent.pop(serial, None)
+            self.resends.pop(serial, None)
+
+        super().removeSerial(serial)
+
+    def evaluated(self, serial: str, idens: list[str]):
+        """Forgets the bitstreams of serial that results arrived for, they will not be resent."""
+        with self.sent_lock:
+            sent = self.sent.get(serial)
+
+            if sent is None:
+                return
+
+            for iden in idens:
+                sent.pop(iden, None)
+
+            if not sent:
+                del self.sent[serial]
+
+    def resendBitstreams(self, serial: str, hashes: list[str]) -> bool:
+        """Queues the bitstreams evaluated on serial with the given hashes to be uploaded again.
+        Each bitstream is resent at most once. Resends that are reported together are streamed to each
+        worker as one batch per set of bitstreams, rather than once per device."""
+        hashes = set(hashes)
+
+        with self.sent_lock:
+            sent = self.sent.get(serial, {})
+            bitstreams = {iden: sent.pop(iden) for iden, (_, digest) in list(sent.items()) if digest in hashes}
+
+            if not bitstreams:
+                return False
+
+            self.resends.setdefault(serial, {}).update(bitstreams)
+
+            if not self.resend_timer:
+                self.resend_timer = threading.Timer(RESEND_DELAY_SECONDS, self.__resend)
+                self.resend_timer.daemon = True
+                self.resend_timer.start()
+
+        return True
+
+    def __resend(self):
+        with self.sent_lock:
+            resends = self.resends
+            self.resends = {}
+            self.resend_timer = None
+
+        # (worker url, bitstreams) -> serials
+        groups: dict[tuple[str, frozenset], list[str]] = {}
+        for serial, bitstreams in resends.items():
+            if not (info := self.getConnectionInfo(serial)):
+                self.logger.error(f"Could not get connection info for serial {serial}")
+                continue
+
+            groups.setdefault((info.url(), frozenset(bitstreams.items())), []).append(serial)
+
+        # url -> digests already uploaded to the worker, later batches only reference them
+        uploaded: dict[str, set[str]] = {}
+        for (url, items), serials in groups.items():
+            bitstreams = {iden: path for iden, (path, _) in items}
+            digests = {iden: digest for iden, (_, digest) in items}
+            missing = set(digests.values()) - uploaded.get(url, set())
+
+            if not self.__stream(url, serials, bitstreams, digests, missing):
+                self.logger.error(f"Failed to resend bitstreams to worker {url} for serials {serials}")
+                continue
+
+            uploaded.setdefault(url, set()).update(missing)
@@ -0,0 +1,39 @@
+from __future__ import annotations
+from usbipice.utils import AsyncDatabase
+
+class AsyncControlDatabase(AsyncDatabase):
+    """Asyncio version of the ControlDatabase calls behind the reservation routes, which the ASGI
+    control server serves on the event loop. Other calls go through ControlDatabase."""
+
+    async def reserve(self, amount: int, clientname: str, reservation_type: str, placement: str="any", worker: str=None) -> dict:
+        """Reserves amount devices for clientname. Placement is one of any, pack (fewest workers),
+        spread (one device per worker in turn) or worker (prefer worker, then pack). Returns as {serial, ip, serverport}"""
+        return await self.getData(
+            "SELECT * FROM makeReservations(%s::int, %s::varchar(255), %s::varchar(255), %s::varchar(255), %s::varchar(255))",
+            (amount, clientname, reservation_type, placement, worker),
+            ["serial", "ip", "serverport"], stringify=["ip"]
+        )
+
+    async def extend(self, name: str, serials: list[str]) -> list[str]:
+        """Extends the reservation time of the serials under the name of the client. Returns the extended serials"""
+        return await self.execute("SELECT * FROM extendReservations(%s::varchar(255), %s::varchar(255)[])", (name, serials))
+
+    async def extendAll(self, name: str) -> list[str]:
+        """Extends the reservation time of all serials under the name of the client. Returns the extended serials."""
+        return await self.execute("SELECT * FROM extendAllReservations(%s::varchar(255))", (name,))
+
+    async def end(self, name: str, serials: list[str]):
+        """Ends the reservation of serials under the name of the client.
+        Returns as {serial, workerip, workerport}"""
+        return await self.getData(
+            "select * from endReservations(%s::varchar(255), %s::varchar(255)[])", (name, serials),
+            ["serial", "workerip", "workerport"], stringify=["workerip", "workerport"]
+        )
+
+    async def endAll(self, name: str):
+        """Ends all of the reservations under the client name.
+        Returns as {serial, workerip, workerport}"""
+        return await self.getData(
+            "SELECT * FROM endAllReservations(%s::varchar(255))", (name,),
+            ["serial", "workerip", "workerport"], stringify=["workerip", "workerport"]
+        )
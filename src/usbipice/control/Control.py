@@ -1,10 +1,8 @@
 from __future__ import annotations
 from logging import Logger
-import threading
+import asyncio
 
-import requests
-
-from usbipice.control import ControlDatabase
+from usbipice.control import ControlDatabase, AsyncControlDatabase, WorkerClient
 
 import typing
 if typing.TYPE_CHECKING:
@@ -15,6 +13,7 @@ class Control:
         self.event_sender = event_sender
         self.database = ControlDatabase(database_url)
         self.logger = logger
+        self.worker_client = WorkerClient(logger)
 
     def extend(self, client_id: str, serials: list[str]) -> list[str]:
         return self.database.extend(client_id, serials)
@@ -22,57 +21,92 @@ class Control:
     def extendAll(self, client_id: str) -> list[str]:
         return self.database.extendAll(client_id)
 
-    def __notifyEnd(self, client_id: str, serial: str, worker_url: str):
-        self.event_sender.sendDeviceReservationEnd(serial, client_id)
+    def notifyEnd(self, client_id: str, rows: list[dict]):
+        """Sends reservation end events and unreserve commands for rows of
+        {serial, workerip, workerport}."""
+        for row in rows:
+            self.event_sender.sendDeviceReservationEnd(row["serial"], client_id)
+            self.event_sender.clearRoute(row["serial"])
+
+        self.worker_client.unreserve(rows)
 
-        try:
-            res = requests.get(f"{worker_url}/unreserve", json={
-                "serial": serial
-            }, timeout=10)
+    def notifyReserve(self, client_id: str, con_info: list[dict], kind: str, args: dict):
+        """Routes events for the reserved devices to client_id and sends reserve commands to their
+        workers without waiting for a response. con_info is a list of {serial, ip, serverport}."""
+        for row in con_info:
+            self.event_sender.setRoute(row["serial"], client_id)
 
-            if res.status_code != 200:
-                raise Exception
-        except Exception:
-            self.logger.warning(f"[Control] failed to send unreserve command to worker {worker_url} device {serial}")
+        self.worker_client.reserve(client_id, con_info, kind, args)
 
     def end(self, client_id: str, serials: list[str]) -> list[str]:
-        data = self.database.end(client_id, serials)
-        for row in data:
-            self.__notifyEnd(client_id, row['serial'], f"http://{row['workerip']}:{row['workerport']}")
+        if (data := self.database.end(client_id, serials)) is False:
+            return False
+
+        self.notifyEnd(client_id, data)
 
         return list(map(lambda row : row["serial"], data))
 
 
     def endAll(self, client_id: str) -> list[str]:
-        data = self.database.endAll(client_id)
-        for row in data:
-            self.__notifyEnd(client_id, row["serial"], f"http://{row['workerip']}:{row['workerport']}")
+        if (data := self.database.endAll(client_id)) is False:
+            return False
+
+        self.notifyEnd(client_id, data)
 
         return list(map(lambda row : row["serial"], data))
 
-    def reserve(self, client_id: str, amount: int, kind:str, args: dict) -> dict:
-        if (con_info := self.database.reserve(amount, client_id, kind)) is False:
+    def reserve(self, client_id: str, amount: int, kind:str, args: dict, placement: str="any", worker: str=None) -> dict:
+        if (con_info := self.database.reserve(amount, client_id, kind, placement, worker)) is False:
             return False
 
-        for row in con_info:
-            def send_reserve():
-                ip = row["ip"]
-                port = row["serverport"]
-                serial = row["serial"]
-
-                try:
-                    res = requests.get(f"http://{ip}:{port}/reserve", json={
-                        "serial": serial,
-                        "kind": kind,
-                        "args": args
-                    }, timeout=15)
-
-                    if res.status_code != 200:
-                        raise Exception
-                except Exception:
-                    pass
-
-            thread = threading.Thread(target=send_reserve, name="send-reservation")
-            thread.start()
+        self.notifyReserve(client_id, con_info, kind, args)
+
+        return con_info
+
+class AsyncControl:
+    """Serves the Control operations from an asyncio event loop. Database access goes through
+    AsyncControlDatabase, while worker notifications are delegated to control and run off the loop."""
+    def __init__(self, control: Control, logger: Logger):
+        self.control = control
+        self.database = AsyncControlDatabase(control.database.url)
+        self.logger = logger
+
+    async def open(self):
+        await self.database.open()
+
+    async def close(self):
+        await self.database.close()
+
+    def __notifyEnd(self, client_id: str, rows: list[dict]):
+        # unreserve commands block on the workers, the caller does not need to wait on them
+        asyncio.get_running_loop().run_in_executor(None, self.control.notifyEnd, client_id, rows)
+
+    async def extend(self, client_id: str, serials: list[str]) -> list[str]:
+        return await self.database.extend(client_id, serials)
+
+    async def extendAll(self, client_id: str) -> list[str]:
+        return await self.database.extendAll(client_id)
+
+    async def end(self, client_id: str, serials: list[str]) -> list[str]:
+        if (data := await self.database.end(client_id, serials)) is False:
+            return False
+
+        self.__notifyEnd(client_id, data)
+
+        return list(map(lambda row : row["serial"], data))
+
+    async def endAll(self, client_id: str) -> list[str]:
+        if (data := await self.database.endAll(client_id)) is False:
+            return False
+
+        self.__notifyEnd(client_id, data)
+
+        return list(map(lambda row : row["serial"], data))
+
+    async def reserve(self, client_id: str, amount: int, kind: str, args: dict, placement: str="any", worker: str=None) -> dict:
+        if (con_info := await self.database.reserve(amount, client_id, kind, placement, worker)) is False:
+            return False
+
+        self.control.notifyReserve(client_id, con_info, kind, args)
 
         return con_info
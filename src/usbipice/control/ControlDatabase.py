@@ -12,10 +12,12 @@ class ControlDatabase(Database):
         ip, port = row[0], row[1]
         return f"http://{ip}:{port}"
 
-    def reserve(self, amount: int, clientname: str, reservation_type: str) -> dict:
-        """Reserves amount devices for clientname. Returns as {serial, ip, serverport}"""
+    def reserve(self, amount: int, clientname: str, reservation_type: str, placement: str="any", worker: str=None) -> dict:
+        """Reserves amount devices for clientname. Placement is one of any, pack (fewest workers),
+        spread (one device per worker in turn) or worker (prefer worker, then pack). Returns as {serial, ip, serverport}"""
         return self.getData(
-            "SELECT * FROM makeReservations(%s::int, %s::varchar(255), %s::varchar(255))", (amount, clientname, reservation_type),
+            "SELECT * FROM makeReservations(%s::int, %s::varchar(255), %s::varchar(255), %s::varchar(255), %s::varchar(255))",
+            (amount, clientname, reservation_type, placement, worker),
             ["serial", "ip", "serverport"], stringify=["ip"]
         )
 
@@ -55,6 +57,13 @@ class ControlDatabase(Database):
         """Updates the last heartbeat time on a worker to the current time"""
         return self.proc("CALL heartbeatWorker(%s::varchar(255))", (name,))
 
+    def heartbeatWorkers(self, names: list[str]):
+        """Updates the last heartbeat time on multiple workers to the current time"""
+        if not names:
+            return True
+
+        return self.proc("CALL heartbeatWorkers(%s::varchar(255)[])", (names,))
+
     def getWorkerTimeouts(self, timeout_dur: int) -> list:
         """Times out the workers that have not had a heartbeat in timeout_dur. Returns the
         timed out workers as a list of (serial, client_id, worker)."""
@@ -63,6 +72,14 @@ class ControlDatabase(Database):
             ["serial", "client_id", "worker"]
         )
 
+    def failWorker(self, name: str) -> list:
+        """Removes a worker that is known to be dead. Returns its reserved devices
+        as a list of (serial, client_id, worker)."""
+        return self.getData(
+            "SELECT * FROM failWorker(%s::varchar(255))", (name,),
+            ["serial", "client_id", "worker"]
+        )
+
     def getReservationEndingSoon(self, minutes: int) -> list[str]:
         """Gets reservations that are ending soon, returns the serials."""
         data = self.execute("SELECT * FROM getReservationsEndingSoon(%s::int)", (minutes,))
@@ -77,3 +94,10 @@ class ControlDatabase(Database):
             "SELECT * FROM handleReservationTimeouts()", tuple(),
             ["serial", "client_id", "workerip", "workerport"], stringify=["workerip", "workerport"]
         )
+
+    def getReservationDeadlines(self) -> list[dict]:
+        """Gets the seconds left on every reservation, returns as {serial, remaining}"""
+        return self.getData(
+            "SELECT * FROM getReservationDeadlines()", tuple(),
+            ["serial", "remaining"]
+        )
@@ -33,3 +33,23 @@ class ControlEventSender(EventSender):
             "event": "reservation ending soon",
         }):
             self.logger.warning(f"failed to send reservation ending soon to device {serial}")
+
+    def sendDeviceReservationAssigned(self, serial: str, client_id: str, ticket: str, ip: str, serverport: int) -> bool:
+        """Sends a reservation assigned event for serial, reserved for a queued ticket."""
+        if not self.sendClientJson(serial, client_id, {
+            "event": "reservation assigned",
+            "ticket": ticket,
+            "ip": ip,
+            "serverport": serverport
+        }):
+            self.logger.warning(f"failed to send reservation assigned to {client_id} for device {serial}")
+
+    def sendTicketExpired(self, client_id: str, ticket: str, remaining: int) -> bool:
+        """Sends a ticket expired event for a queued ticket that was dropped with remaining devices
+        unassigned. The event is not for a device, so it has no serial."""
+        if not self.sendClientJson(None, client_id, {
+            "event": "ticket expired",
+            "ticket": ticket,
+            "remaining": remaining
+        }):
+            self.logger.warning(f"failed to send ticket expired to {client_id} for ticket {ticket}")
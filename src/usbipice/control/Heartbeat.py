@@ -1,12 +1,13 @@
 from __future__ import annotations
 from logging import Logger, LoggerAdapter
+from concurrent.futures import ThreadPoolExecutor
 import threading
 import time
 
-import requests
 import schedule
 
 from usbipice.control import ControlDatabase
+from usbipice.utils import get_transport
 
 import typing
 if typing.TYPE_CHECKING:
@@ -16,10 +17,14 @@ if typing.TYPE_CHECKING:
 class HeartbeatConfig:
     def __init__(self):
        self.heartbeat_poll_seconds: str = 15
+       # ticks start at a random point up to this many seconds after the poll interval
+       self.heartbeat_jitter_seconds: str = 3
+       self.heartbeat_timeout_seconds: str = 5
+       self.heartbeat_max_concurrency: str = 32
+       # seconds a worker's push channel may be down before the worker is probed and failed
+       self.push_disconnect_grace_seconds: str = 5
        self.timeout_poll_seconds: str = 15
        self.timeout_duration_seconds: str = 60
-       self.reservation_poll_seconds: str = 30
-       self.reservation_expiring_poll_seconds: str = 300
        self.reservation_expiring_notify_at_seconds: str = 20 * 60
 
 class HeartbeatLogger(LoggerAdapter):
@@ -37,11 +42,24 @@ class Heartbeat:
         self.config = config
         self.thread = None
 
+        self.executor = ThreadPoolExecutor(max_workers=config.heartbeat_max_concurrency, thread_name_prefix="heartbeat-probe")
+        # keeps connections to workers alive between ticks
+        self.transport = get_transport()
+
+        # held while a tick runs, ticks that start before the previous one finishes are skipped
+        self.tick_lock = threading.Lock()
+        self.rtt: dict[str, float] = {}
+        self.rtt_lock = threading.Lock()
+
+        # workers pushing heartbeats over a socket, these are not polled
+        self.push_lock = threading.Lock()
+        self.push_sockets: dict[str, set[str]] = {}
+        self.pushed: dict[str, dict] = {}
+        self.disconnect_timers: dict[str, threading.Timer] = {}
+
     def start(self):
         self.__startHeartBeatWorkers()
         self.__startWorkerTimeouts()
-        self.__startReservationTimeouts()
-        self.__startReservationEndingSoon()
 
         def run():
             while True:
@@ -51,51 +69,162 @@ class Heartbeat:
         self.thread = threading.Thread(target=run, daemon=True, name="heartbeat")
         self.thread.start()
 
-    # TODO duplicated from control.Control
-    # not sure where to put this
-    def __notifyEnd(self, client_id: str, serial: str, worker_url: str):
-        self.event_sender.sendDeviceReservationEnd(serial, client_id)
+    def getRoundTripTimes(self) -> dict[str, float]:
+        """Returns the round trip time in seconds of the last successful heartbeat of each worker."""
+        with self.rtt_lock:
+            return dict(self.rtt)
+
+    def getPushedHeartbeats(self) -> dict[str, dict]:
+        """Returns the last pushed heartbeat of each worker with an open channel as {age, devices, queue},
+        where age is the amount of seconds since it was pushed."""
+        now = time.monotonic()
+
+        with self.push_lock:
+            pushed = {name: self.pushed[name] for name in self.push_sockets if name in self.pushed}
+
+        return {name: {
+            "age": now - heartbeat["time"],
+            "devices": heartbeat["devices"],
+            "queue": heartbeat["queue"]
+        } for name, heartbeat in pushed.items()}
+
+    def handleWorkerConnect(self, sock_id: str, name: str):
+        """Called when a worker opens a push channel."""
+        with self.push_lock:
+            self.push_sockets.setdefault(name, set()).add(sock_id)
+
+            if timer := self.disconnect_timers.pop(name, None):
+                timer.cancel()
+
+        self.logger.info(f"{name} opened heartbeat channel")
+
+    def handleWorkerHeartbeat(self, sock_id: str, name: str, devices: int, queue: int):
+        """Called when a worker pushes a heartbeat."""
+        with self.push_lock:
+            self.pushed[name] = {"time": time.monotonic(), "devices": devices, "queue": queue}
+
+    def handleWorkerDisconnect(self, sock_id: str, name: str):
+        """Called when a worker's push channel closes. If it is not reopened within
+        push_disconnect_grace_seconds the worker is probed, and failed if it does not respond."""
+        with self.push_lock:
+            sockets = self.push_sockets.get(name, set())
+            sockets.discard(sock_id)
+
+            if sockets:
+                return
+
+            self.push_sockets.pop(name, None)
+            self.pushed.pop(name, None)
+
+            timer = threading.Timer(self.config.push_disconnect_grace_seconds, lambda : self.__checkDisconnected(name))
+            timer.daemon = True
+            timer.name = f"heartbeat-{name}-disconnect"
+            self.disconnect_timers[name] = timer
+            timer.start()
+
+        self.logger.warning(f"{name} closed heartbeat channel")
+
+    def __checkDisconnected(self, name: str):
+        with self.push_lock:
+            if name in self.push_sockets:
+                return
+
+            self.disconnect_timers.pop(name, None)
+
+        if (workers := self.database.getWorkers()) is False:
+            self.logger.error(f"failed to get workers to check {name}")
+            return
+
+        row = next(filter(lambda row : row["name"] == name, workers), None)
+        if not row:
+            return
+
+        if self.__probe(row) is not False:
+            self.logger.warning(f"{name} closed heartbeat channel but responds to heartbeats")
+            return
+
+        if (data := self.database.failWorker(name)) is False:
+            self.logger.error(f"failed to remove failed worker {name}")
+            return
+
+        self.logger.error(f"{name} failed after its heartbeat channel closed")
+
+        for row in data:
+            self.event_sender.sendDeviceFailure(row["serial"], row["client_id"])
+            self.logger.info(f"Worker {name} failed; sent device failure for client {row['client_id']} device {row['serial']}")
+
+    def __pushing(self) -> set[str]:
+        """Workers with an open channel that pushed a heartbeat within the timeout duration."""
+        cutoff = time.monotonic() - self.config.timeout_duration_seconds
+
+        with self.push_lock:
+            return {name for name in self.push_sockets if self.pushed.get(name, {}).get("time", cutoff) > cutoff}
+
+    def __probe(self, row: dict) -> float:
+        """Sends a heartbeat to a worker, returns the round trip time or False on failure."""
+        url = f"http://{row['ip']}:{row['port']}/heartbeat"
+        start = time.perf_counter()
 
         try:
-            res = requests.get(f"{worker_url}/unreserve", json={
-                "serial": serial
-            }, timeout=10)
+            res = self.transport.get(url, timeout=self.config.heartbeat_timeout_seconds)
 
             if res.status_code != 200:
                 raise Exception
         except Exception:
-            self.logger.warning(f"[Control] failed to send unreserve command to worker {worker_url} device {serial}")
+            return False
+
+        return time.perf_counter() - start
+
+    def __heartbeatWorkers(self):
+        if not (workers := self.database.getWorkers()):
+            return
+
+        pushing = self.__pushing()
+        workers = [row for row in workers if row["name"] not in pushing]
+
+        rtts = self.executor.map(self.__probe, workers)
+
+        # pushed heartbeats are written with the polled ones
+        alive = list(pushing)
+        rtt_by_name = {}
+        for row, rtt in zip(workers, rtts):
+            name = row["name"]
+
+            if rtt is False:
+                self.logger.error(f"{name} failed heartbeat check")
+                continue
+
+            alive.append(name)
+            rtt_by_name[name] = rtt
+
+            self.logger.debug(f"heartbeat success for {name} in {rtt * 1000:.1f}ms")
+
+        # workers that failed or push their heartbeats have no current round trip time
+        with self.rtt_lock:
+            self.rtt = rtt_by_name
+
+        if not self.database.heartbeatWorkers(alive):
+            self.logger.error(f"failed to update heartbeat for {alive}")
+
+        stats = self.transport.stats()
+        self.logger.debug(f"http connections opened {stats['connections']} for {stats['requests']} requests, {stats['reused']} reused")
 
     def __startHeartBeatWorkers(self):
         def do():
-            def run():
-                workers = self.database.getWorkers()
+            if not self.tick_lock.acquire(blocking=False):
+                self.logger.warning("previous heartbeat is still running, skipping")
+                return
 
-                if not workers:
-                    return
-
-                for row in workers:
-                    name = row["name"]
-                    ip = row["ip"]
-                    port = row["port"]
-
-                    url = f"http://{ip}:{port}/heartbeat"
-                    try:
-                        req = requests.get(url, timeout=10)
-
-                        if req.status_code != 200:
-                            raise Exception
-                    except Exception:
-                        self.logger.error(f"{name} failed heartbeat check")
-                    else:
-                        if not self.database.heartbeatWorker(name):
-                            self.logger.error(f"failed to update heartbeat for {name}")
-                        else:
-                            self.logger.debug(f"heartbeat success for {name}")
+            def run():
+                try:
+                    self.__heartbeatWorkers()
+                finally:
+                    self.tick_lock.release()
 
             threading.Thread(target=run, name="heartbeat-worker", daemon=True).start()
 
-        schedule.every(self.config.heartbeat_poll_seconds).seconds.do(do)
+        poll = self.config.heartbeat_poll_seconds
+        schedule.every(poll).to(poll + self.config.heartbeat_jitter_seconds).seconds.do(do)
 
     def __startWorkerTimeouts(self):
         def do():
@@ -111,31 +240,3 @@ class Heartbeat:
             threading.Thread(target=run, name="heartbeat-worker-timeouts", daemon=True).start()
 
         schedule.every(self.config.timeout_poll_seconds).seconds.do(do)
-
-    def __startReservationTimeouts(self):
-        def do():
-            def run():
-                if not (data := self.database.getReservationTimeouts()):
-                    return
-
-                for row in data:
-                    self.__notifyEnd(row["client_id"], row["serial"], f"http://{row["workerip"]}:{row["workerport"]}")
-                    self.logger.info(f"Reservation for device {row['serial']} by client {row['client_id']} ended")
-
-            threading.Thread(target=run, name="heartbeat-reservation-timeouts", daemon=True).start()
-
-        schedule.every(self.config.reservation_poll_seconds).seconds.do(do)
-
-    def __startReservationEndingSoon(self):
-        def do():
-            def run(notify_at=self.config.reservation_expiring_notify_at_seconds):
-                if not (data := self.database.getReservationEndingSoon(notify_at)):
-                    return
-
-                for serial in data:
-                    self.event_sender.sendDeviceReservationEndingSoon(serial)
-                    self.logger.info(f"Sent ending soon notification for {serial}")
-
-            threading.Thread(target=run, name="heartbeat-reservation-ending-soon", daemon=True).start()
-
-        schedule.every(self.config.reservation_poll_seconds).seconds.do(do)
@@ -0,0 +1,161 @@
+from __future__ import annotations
+from logging import Logger, LoggerAdapter
+from itertools import groupby
+import heapq
+import itertools
+import json
+import threading
+import time
+
+from usbipice.control import ControlDatabase
+from usbipice.utils import DatabaseListener
+
+import typing
+if typing.TYPE_CHECKING:
+    from usbipice.control import Control, ControlEventSender, HeartbeatConfig
+
+# seconds past a deadline before retrying a reservation the database did not end yet,
+# which happens when the database clock is slightly behind
+RETRY_SECONDS = 1
+
+class ReservationTimerLogger(LoggerAdapter):
+    def __init__(self, logger, extra=None):
+        super().__init__(logger, extra)
+
+    def process(self, msg, kwargs):
+        return f"[ReservationTimer] {msg}", kwargs
+
+class ReservationTimer:
+    """Ends reservations and sends ending soon events when they are due. Expiry times are kept in
+    a heap that is updated from reservation_changed notifications, so the database is only queried
+    when a reservation is actually due. Ending soon is sent once for each expiry time, extending a
+    reservation rearms it."""
+    def __init__(self, control: Control, event_sender: ControlEventSender, database_url: str, config: HeartbeatConfig, logger: Logger):
+        self.control = control
+        self.event_sender = event_sender
+        self.database = ControlDatabase(database_url)
+        self.config = config
+        self.logger = ReservationTimerLogger(logger)
+
+        # serial -> monotonic expiry time, heap entries that do not match are stale
+        self.deadlines: dict[str, float] = {}
+        self.heap: list[tuple[float, int, str, str, float]] = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+
+        self.listener = DatabaseListener(database_url, ["reservation_changed"], self.__onNotify, logger, on_connect=self.__seed)
+        self.thread = None
+
+    def start(self):
+        self.listener.start()
+        self.thread = threading.Thread(target=self.__run, daemon=True, name="reservation-timer")
+        self.thread.start()
+
+    def __push(self, at: float, action: str, serial: str, expiry: float):
+        heapq.heappush(self.heap, (at, next(self.counter), action, serial, expiry))
+
+    def __set(self, serial: str, remaining: float):
+        """Should be called with the condition held."""
+        now = time.monotonic()
+        expiry = now + remaining
+        self.deadlines[serial] = expiry
+
+        notify_at = self.config.reservation_expiring_notify_at_seconds
+        self.__push(max(now, expiry - notify_at), "ending soon", serial, expiry)
+        self.__push(expiry, "end", serial, expiry)
+
+    def __seed(self):
+        """Replaces the known deadlines with the database's, notifications may have been missed."""
+        if (data := self.database.getReservationDeadlines()) is False:
+            self.logger.error("failed to get reservation deadlines")
+            return
+
+        with self.cond:
+            self.deadlines = {}
+            self.heap = []
+
+            for row in data:
+                self.__set(row["serial"], float(row["remaining"]))
+
+            self.cond.notify()
+
+        self.logger.info(f"tracking {len(data)} reservations")
+
+    def __onNotify(self, channel, payload):
+        try:
+            msg = json.loads(payload)
+            serial = msg["serial"]
+            op = msg["op"]
+        except Exception:
+            self.logger.error(f"bad notification {payload}")
+            return
+
+        with self.cond:
+            if op == "DELETE":
+                self.deadlines.pop(serial, None)
+            else:
+                self.__set(serial, float(msg["remaining"]))
+
+            self.cond.notify()
+
+    def __due(self) -> tuple[list[str], list[str]]:
+        """Waits until entries are due, returns the serials to send ending soon to and
+        the serials that have expired."""
+        with self.cond:
+            while True:
+                # drop stale entries so they do not cause wakeups
+                while self.heap and self.deadlines.get(self.heap[0][3]) != self.heap[0][4]:
+                    heapq.heappop(self.heap)
+
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+
+                wait = self.heap[0][0] - time.monotonic()
+                if wait <= 0:
+                    break
+
+                self.cond.wait(timeout=wait)
+
+            ending_soon, expired = [], []
+            now = time.monotonic()
+
+            while self.heap and self.heap[0][0] <= now:
+                _, _, action, serial, expiry = heapq.heappop(self.heap)
+
+                if self.deadlines.get(serial) != expiry:
+                    continue
+
+                if action == "ending soon":
+                    ending_soon.append(serial)
+                else:
+                    expired.append(serial)
+                    # retried if the reservation is not ended, a delete notification cancels this
+                    self.__push(now + RETRY_SECONDS, "end", serial, expiry)
+
+            return ending_soon, expired
+
+    def __endExpired(self):
+        if not (data := self.database.getReservationTimeouts()):
+            return
+
+        for client_id, rows in groupby(sorted(data, key=lambda row : row["client_id"]), lambda row : row["client_id"]):
+            rows = list(rows)
+            self.control.notifyEnd(client_id, rows)
+
+            for row in rows:
+                self.logger.info(f"Reservation for device {row['serial']} by client {client_id} ended")
+
+    def __run(self):
+        while True:
+            ending_soon, expired = self.__due()
+
+            try:
+                for serial in ending_soon:
+                    self.event_sender.sendDeviceReservationEndingSoon(serial)
+                    self.logger.info(f"Sent ending soon notification for {serial}")
+
+                if expired:
+                    self.__endExpired()
+            except Exception as e:
+                self.logger.error(f"failed to handle due reservations: {e}")
@@ -0,0 +1,166 @@
+from __future__ import annotations
+from logging import Logger, LoggerAdapter
+import heapq
+import itertools
+import threading
+import time
+import uuid
+
+from usbipice.utils import DatabaseListener
+
+import typing
+if typing.TYPE_CHECKING:
+    from usbipice.control import Control, ControlEventSender
+
+class WaitlistLogger(LoggerAdapter):
+    def __init__(self, logger, extra=None):
+        super().__init__(logger, extra)
+
+    def process(self, msg, kwargs):
+        return f"[Waitlist] {msg}", kwargs
+
+class Ticket:
+    def __init__(self, client_id: str, amount: int, kind: str, args: dict, priority: int,
+                 deadline: float, placement: str, worker: str):
+        self.id = str(uuid.uuid4())
+        self.client_id = client_id
+        self.remaining = amount
+        self.kind = kind
+        self.args = args
+        self.priority = priority
+        self.deadline = deadline
+        self.placement = placement
+        self.worker = worker
+        self.cancelled = False
+
+class Waitlist:
+    """Queues reservations that could not be filled immediately. Waiting tickets are served by
+    highest priority, then first come first served, whenever the database reports a device as
+    available. Devices are reserved as they become available and each assignment is sent to
+    the client as a 'reservation assigned' event. Unfilled tickets are dropped at their deadline and
+    the client is sent a 'ticket expired' event."""
+    def __init__(self, control: Control, event_sender: ControlEventSender, database_url: str, logger: Logger):
+        self.control = control
+        self.event_sender = event_sender
+        self.logger = WaitlistLogger(logger)
+
+        self.heap: list[tuple[int, int, Ticket]] = []
+        self.tickets: dict[str, Ticket] = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+        self.wake = threading.Event()
+        self.listener = DatabaseListener(database_url, ["device_available"], self.__onNotify, logger, on_connect=self.wake.set)
+        self.thread = None
+
+    def start(self):
+        self.listener.start()
+        self.thread = threading.Thread(target=self.__run, daemon=True, name="waitlist")
+        self.thread.start()
+
+    def enqueue(self, client_id: str, amount: int, kind: str, args: dict, timeout: int, priority: int=0,
+                placement: str="any", worker: str=None) -> str:
+        """Queues a reservation of amount devices for client_id that is given up after timeout seconds.
+        Higher priorities are served first. Returns the ticket id."""
+        ticket = Ticket(client_id, amount, kind, args, priority, time.monotonic() + timeout, placement, worker)
+
+        with self.lock:
+            self.tickets[ticket.id] = ticket
+            heapq.heappush(self.heap, (-priority, next(self.counter), ticket))
+
+        self.logger.info(f"client {client_id} queued for {amount} {kind} devices as {ticket.id}")
+        self.wake.set()
+
+        return ticket.id
+
+    def cancel(self, client_id: str, ticket_id: str) -> bool:
+        """Removes a ticket from the queue. Devices that were already assigned remain reserved.
+        Returns whether the ticket was waiting."""
+        with self.lock:
+            ticket = self.tickets.get(ticket_id)
+            if not ticket or ticket.client_id != client_id:
+                return False
+
+            del self.tickets[ticket_id]
+            # lazily removed from the heap
+            ticket.cancelled = True
+
+        self.logger.info(f"client {client_id} cancelled {ticket_id}")
+        return True
+
+    def __onNotify(self, channel, payload):
+        self.wake.set()
+
+    def __pending(self) -> list[Ticket]:
+        """Drops cancelled and expired tickets, returns the rest in serving order."""
+        now = time.monotonic()
+        expired = []
+
+        with self.lock:
+            for _, _, ticket in self.heap:
+                if not ticket.cancelled and ticket.deadline <= now:
+                    ticket.cancelled = True
+                    self.tickets.pop(ticket.id, None)
+                    expired.append(ticket)
+
+            self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+
+            pending = [ticket for _, _, ticket in sorted(self.heap)]
+
+        for ticket in expired:
+            self.logger.info(f"{ticket.id} for client {ticket.client_id} expired with {ticket.remaining} devices unassigned")
+            self.event_sender.sendTicketExpired(ticket.client_id, ticket.id, ticket.remaining)
+
+        return pending
+
+    def __assign(self):
+        # a ticket that cannot be filled blocks later tickets of the same kind,
+        # so that lower priorities do not take the devices it is waiting for
+        blocked = set()
+
+        for ticket in self.__pending():
+            if ticket.kind in blocked:
+                continue
+
+            con_info = self.control.database.reserve(ticket.remaining, ticket.client_id, ticket.kind, ticket.placement, ticket.worker)
+            if con_info is False:
+                self.logger.error(f"failed to reserve devices for {ticket.id}")
+                blocked.add(ticket.kind)
+                continue
+
+            if con_info:
+                self.control.notifyReserve(ticket.client_id, con_info, ticket.kind, ticket.args)
+
+                for row in con_info:
+                    self.event_sender.sendDeviceReservationAssigned(row["serial"], ticket.client_id, ticket.id, row["ip"], row["serverport"])
+
+            with self.lock:
+                ticket.remaining -= len(con_info)
+
+                if ticket.remaining <= 0:
+                    ticket.cancelled = True
+                    self.tickets.pop(ticket.id, None)
+                    self.logger.info(f"{ticket.id} for client {ticket.client_id} filled")
+
+            if ticket.remaining > 0:
+                blocked.add(ticket.kind)
+
+    def __nextDeadline(self) -> float:
+        with self.lock:
+            deadlines = [ticket.deadline for _, _, ticket in self.heap if not ticket.cancelled]
+
+        if not deadlines:
+            return None
+
+        return max(0, min(deadlines) - time.monotonic())
+
+    def __run(self):
+        while True:
+            self.wake.wait(timeout=self.__nextDeadline())
+            self.wake.clear()
+
+            try:
+                self.__assign()
+            except Exception as e:
+                self.logger.error(f"failed to assign queued reservations: {e}")
@@ -0,0 +1,67 @@
+from __future__ import annotations
+from logging import Logger, LoggerAdapter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from usbipice.utils import get_transport
+
+MAX_CONCURRENT_WORKERS = 32
+
+class WorkerClientLogger(LoggerAdapter):
+    def __init__(self, logger, extra=None):
+        super().__init__(logger, extra)
+
+    def process(self, msg, kwargs):
+        return f"[WorkerClient] {msg}", kwargs
+
+class WorkerClient:
+    """Sends reserve and unreserve commands to workers. Devices are grouped by worker so that
+    each worker receives a single batch request, and requests to different workers are sent
+    concurrently."""
+    def __init__(self, logger: Logger):
+        self.logger = WorkerClientLogger(logger)
+        self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WORKERS, thread_name_prefix="worker-client")
+        self.transport = get_transport()
+
+    def __group(self, rows: list[dict], ip_key: str, port_key: str) -> dict[str, list[str]]:
+        """Groups rows by worker url, returns url -> serials."""
+        groups = {}
+        for row in rows:
+            groups.setdefault(f"http://{row[ip_key]}:{row[port_key]}", []).append(row["serial"])
+
+        return groups
+
+    def __send(self, url: str, endpoint: str, json: dict, timeout: int) -> list[str]:
+        """Sends json to a worker endpoint, returns the serials that the worker handled."""
+        try:
+            res = self.transport.get(f"{url}/{endpoint}", json=json, timeout=timeout)
+
+            if res.status_code != 200:
+                raise Exception
+
+            return res.json()
+        except Exception:
+            self.logger.warning(f"failed to send {endpoint} command to worker {url} devices {json['serials']}")
+            return []
+
+    def reserve(self, client_id: str, con_info: list[dict], kind: str, args: dict):
+        """Sends reserve commands for con_info, a list of {serial, ip, serverport}, without
+        waiting for a response."""
+        for url, serials in self.__group(con_info, "ip", "serverport").items():
+            self.executor.submit(self.__send, url, "reservebatch", {
+                "serials": serials,
+                "kind": kind,
+                "args": args,
+                "name": client_id
+            }, 15)
+
+    def unreserve(self, rows: list[dict]) -> list[str]:
+        """Sends unreserve commands for rows of {serial, workerip, workerport} and waits for
+        the workers. Returns the serials that were unreserved."""
+        futures = [
+            self.executor.submit(self.__send, url, "unreservebatch", {"serials": serials}, 10)
+            for url, serials in self.__group(rows, "workerip", "workerport").items()
+        ]
+
+        wait(futures)
+
+        return [serial for future in futures for serial in future.result()]
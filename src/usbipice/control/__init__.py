@@ -1,4 +1,8 @@
 from usbipice.control.ControlDatabase import ControlDatabase
+from usbipice.control.AsyncControlDatabase import AsyncControlDatabase
 from usbipice.control.ControlEventSender import ControlEventSender
 from usbipice.control.Heartbeat import HeartbeatConfig, Heartbeat
-from usbipice.control.Control import Control
+from usbipice.control.WorkerClient import WorkerClient
+from usbipice.control.Control import Control, AsyncControl
+from usbipice.control.Waitlist import Waitlist
+from usbipice.control.ReservationTimer import ReservationTimer
@@ -3,14 +3,14 @@ import logging
 import sys
 import threading
 
-from flask import Flask, request
+from flask import Flask, request, jsonify
 from flask_socketio import SocketIO
 from socketio import ASGIApp
 from asgiref.wsgi import WsgiToAsgi
 
-from usbipice.control import Control, Heartbeat, HeartbeatConfig, ControlEventSender
-from usbipice.utils.web import SyncAsyncServer
-from usbipice.utils.web import flask_socketio_adapter_connect, flask_socketio_adapter_on, inject_and_return_json
+from usbipice.control import Control, AsyncControl, Heartbeat, HeartbeatConfig, ControlEventSender, Waitlist, ReservationTimer
+from usbipice.utils.web import SyncAsyncServer, AsyncRouter
+from usbipice.utils.web import flask_socketio_adapter_connect, flask_socketio_adapter_on, inject_and_return_json, async_inject_and_return_json
 
 class ControlLogger(logging.LoggerAdapter):
     def __init__(self, logger, extra=None):
@@ -30,16 +30,37 @@ def create_app(app: Flask, socketio: SocketIO | SyncAsyncServer, base_logger: lo
     id_lock = threading.Lock()
 
     event_sender = ControlEventSender(socketio, DATABASE_URL, logger)
+    event_sender.start()
     control = Control(event_sender, DATABASE_URL, logger)
 
     heartbeat_config = HeartbeatConfig()
     heartbeat = Heartbeat(event_sender, DATABASE_URL, heartbeat_config, logger)
     heartbeat.start()
 
+    reservation_timer = ReservationTimer(control, event_sender, DATABASE_URL, heartbeat_config, logger)
+    reservation_timer.start()
+
+    waitlist = Waitlist(control, event_sender, DATABASE_URL, logger)
+    waitlist.start()
+
     @app.get("/reserve")
     @inject_and_return_json
-    def make_reservations(amount: int, name: str, kind: str, args: dict):
-        return control.reserve(name, amount, kind, args)
+    def make_reservations(amount: int, name: str, kind: str, args: dict, placement: str="any", worker: str=None):
+        return control.reserve(name, amount, kind, args, placement, worker)
+
+    @app.get("/reservequeue")
+    @inject_and_return_json
+    def queue_reservations(amount: int, name: str, kind: str, args: dict, timeout: int=3600, priority: int=0,
+                           placement: str="any", worker: str=None):
+        return waitlist.enqueue(name, amount, kind, args, timeout, priority, placement, worker)
+
+    @app.get("/cancelqueue")
+    @inject_and_return_json
+    def cancel_queue(name: str, ticket: str):
+        if not waitlist.cancel(name, ticket):
+            return []
+
+        return [ticket]
 
     @app.get("/extend")
     @inject_and_return_json
@@ -73,9 +94,33 @@ def create_app(app: Flask, socketio: SocketIO | SyncAsyncServer, base_logger: lo
 
         return True
 
+    @app.get("/stats")
+    def stats():
+        stats = {
+            "events": event_sender.queueStats(),
+            "workers": {
+                "rtt": heartbeat.getRoundTripTimes(),
+                "pushed": heartbeat.getPushedHeartbeats()
+            }
+        }
+
+        if isinstance(socketio, SyncAsyncServer):
+            stats["emits"] = socketio.emit_stats()
+
+        return jsonify(stats)
+
+    sock_id_to_worker = {}
+
     @socketio.on("connect")
     @flask_socketio_adapter_connect
     def connection(sid, environ, auth):
+        if worker := auth.get("worker"):
+            with id_lock:
+                sock_id_to_worker[sid] = worker
+
+            heartbeat.handleWorkerConnect(sid, worker)
+            return
+
         client_id = auth.get("client_id")
         if not client_id:
             logger.warning("socket connection without client id")
@@ -86,14 +131,19 @@ def create_app(app: Flask, socketio: SocketIO | SyncAsyncServer, base_logger: lo
         with id_lock:
             sock_id_to_client_id[sid] = client_id
 
-        event_sender.addSocket(sid, client_id)
+        event_sender.addSocket(sid, client_id, bool(auth.get("batch")), auth.get("resume"))
 
     @socketio.on("disconnect")
     @flask_socketio_adapter_on
     def disconnect(sid, reason):
         with id_lock:
+            worker = sock_id_to_worker.pop(sid, None)
             client_id = sock_id_to_client_id.pop(sid, None)
 
+        if worker:
+            heartbeat.handleWorkerDisconnect(sid, worker)
+            return
+
         if not client_id:
             logger.warning("disconnected socket had no known client id")
             return
@@ -102,6 +152,67 @@ def create_app(app: Flask, socketio: SocketIO | SyncAsyncServer, base_logger: lo
 
         event_sender.removeSocket(client_id)
 
+    @socketio.on("ack")
+    @flask_socketio_adapter_on
+    def ack(sid, seq):
+        with id_lock:
+            client_id = sock_id_to_client_id.get(sid)
+
+        if not client_id or not isinstance(seq, int):
+            logger.warning("bad event acknowledgement")
+            return
+
+        event_sender.ack(client_id, seq)
+
+    @socketio.on("worker heartbeat")
+    @flask_socketio_adapter_on
+    def worker_heartbeat(sid, data):
+        with id_lock:
+            worker = sock_id_to_worker.get(sid)
+
+        if not worker or not isinstance(data, dict):
+            logger.warning("bad worker heartbeat")
+            return
+
+        heartbeat.handleWorkerHeartbeat(sid, worker, data.get("devices"), data.get("queue"))
+
+    return control
+
+def create_async_app(control: Control, fallback, base_logger: logging.Logger) -> tuple[AsyncRouter, AsyncControl]:
+    """Serves the reservation routes natively on the ASGI event loop, so that requests
+    do not hold a threadpool thread while waiting on the database. Other requests are passed
+    to fallback. AsyncControl.open and AsyncControl.close should be run on startup and shutdown."""
+    logger = ControlLogger(base_logger)
+    async_control = AsyncControl(control, logger)
+    router = AsyncRouter(fallback)
+
+    @router.get("/reserve")
+    @async_inject_and_return_json
+    async def make_reservations(amount: int, name: str, kind: str, args: dict, placement: str="any", worker: str=None):
+        return await async_control.reserve(name, amount, kind, args, placement, worker)
+
+    @router.get("/extend")
+    @async_inject_and_return_json
+    async def extend(name: str, serials: list):
+        return await async_control.extend(name, serials)
+
+    @router.get("/extendall")
+    @async_inject_and_return_json
+    async def extendall(name: str):
+        return await async_control.extendAll(name)
+
+    @router.get("/end")
+    @async_inject_and_return_json
+    async def end(name: str, serials: list):
+        return await async_control.end(name, serials)
+
+    @router.get("/endall")
+    @async_inject_and_return_json
+    async def endall(name: str):
+        return await async_control.endAll(name)
+
+    return router, async_control
+
 def run_debug():
     SERVER_PORT = int(os.environ.get("USBIPICE_CONTROL_PORT", "8080"))
 
@@ -123,10 +234,10 @@ def run_uvicorn():
 
     app = Flask(__name__)
     socketio = SyncAsyncServer(async_mode="asgi")
-    create_app(app, socketio, logger)
-    app = WsgiToAsgi(app)
+    control = create_app(app, socketio, logger)
+    router, async_control = create_async_app(control, WsgiToAsgi(app), logger)
 
-    return ASGIApp(socketio, app)
+    return ASGIApp(socketio, router, on_startup=async_control.open, on_shutdown=async_control.close)
 
 
 if __name__ == "__main__":
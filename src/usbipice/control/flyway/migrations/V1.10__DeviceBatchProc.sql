@@ -0,0 +1,43 @@
+-- Set based versions of addDevice and updateDeviceStatus so that a worker can register
+-- and update many devices in one round trip.
+CREATE PROCEDURE addDevices(deviceserials varchar(255)[], wname varchar(255))
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM Worker WHERE WorkerName = wname) THEN
+        RAISE EXCEPTION 'Worker does not exist';
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM Device WHERE SerialId = ANY(deviceserials)) THEN
+        RAISE EXCEPTION 'Device serial already exists';
+    END IF;
+
+    INSERT INTO Device(SerialID, Worker, DeviceStatus)
+    SELECT DISTINCT serial, wname, 'await_flash_default'::DeviceState
+    FROM unnest(deviceserials) AS serial;
+END
+$$;
+
+CREATE PROCEDURE updateDeviceStatuses(deviceserials varchar(255)[], dstates DeviceState[])
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF array_length(deviceserials, 1) IS DISTINCT FROM array_length(dstates, 1) THEN
+        RAISE EXCEPTION 'Serial and state counts differ';
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM unnest(deviceserials) AS serial
+        WHERE NOT EXISTS (SELECT 1 FROM Device WHERE SerialId = serial)
+    ) THEN
+        RAISE EXCEPTION 'Device serial does not exist';
+    END IF;
+
+    UPDATE Device
+    SET DeviceStatus = updates.dstate
+    FROM unnest(deviceserials, dstates) AS updates(serial, dstate)
+    WHERE Device.SerialID = updates.serial;
+END
+$$;
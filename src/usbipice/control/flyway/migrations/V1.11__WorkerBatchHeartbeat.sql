@@ -0,0 +1,13 @@
+-- Updates the heartbeat of every worker that responded in a tick in one statement.
+-- Unlike heartbeatWorker, unknown workers are ignored, since a worker may be removed
+-- while it is being probed.
+CREATE PROCEDURE heartbeatWorkers(wnames varchar(255)[])
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    UPDATE Worker
+    SET LastHeartbeat = CURRENT_TIMESTAMP
+    WHERE WorkerName = ANY(wnames);
+END
+$$;
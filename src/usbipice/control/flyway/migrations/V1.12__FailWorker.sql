@@ -0,0 +1,22 @@
+-- Removes a single worker that the control found to be dead, returning its reserved
+-- devices like handleWorkerTimeouts.
+CREATE FUNCTION failWorker(wname varchar(255))
+RETURNS TABLE (
+    "SerialId" varchar(255),
+    "ClientName" varchar(255),
+    "WorkerName" varchar(255)
+)
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    RETURN QUERY
+    SELECT Device.SerialId, Reservations.ClientName, Device.Worker
+    FROM Device
+    INNER JOIN Reservations ON Reservations.Device = Device.SerialId
+    WHERE Device.Worker = wname;
+
+    DELETE FROM Worker
+    WHERE WorkerName = wname;
+END
+$$;
@@ -0,0 +1,38 @@
+-- Concurrent callers lock the devices they pick and skip devices locked by others,
+-- so parallel reservations receive disjoint devices without a temporary table.
+CREATE OR REPLACE FUNCTION makeReservations(amount int, clientName varchar(255), reservationType varchar(255))
+RETURNS TABLE (
+    "SerialID" varchar(255),
+    "Host" varchar(255),
+    "WorkerPort" int
+)
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    RETURN QUERY
+    WITH picked AS (
+        SELECT Device.SerialID
+        FROM Device
+        INNER JOIN Worker ON Worker.WorkerName = Device.Worker
+        WHERE DeviceStatus = 'available' AND reservationType = ANY(Worker.Reservables)
+        LIMIT amount
+        FOR UPDATE OF Device SKIP LOCKED
+    ),
+    reserved AS (
+        UPDATE Device
+        SET DeviceStatus = 'reserved'
+        FROM picked
+        WHERE Device.SerialID = picked.SerialID
+        RETURNING Device.SerialID, Device.Worker
+    ),
+    inserted AS (
+        INSERT INTO Reservations(Device, ClientName, Until)
+        SELECT reserved.SerialID, clientName, CURRENT_TIMESTAMP + interval '1 hour'
+        FROM reserved
+    )
+    SELECT reserved.SerialID, Worker.Host, Worker.ServerPort
+    FROM reserved
+    INNER JOIN Worker ON Worker.WorkerName = reserved.Worker;
+END
+$$;
@@ -0,0 +1,69 @@
+-- Placement policies:
+--  any    - whichever available devices are found first
+--  pack   - as few workers as possible. A worker that can fit the whole reservation is preferred,
+--           choosing the one with the least available devices so larger workers stay free.
+--           Otherwise workers with the most available devices are used first.
+--  spread - one device per worker in turn
+--  worker - devices on preferredWorker first, then packed onto the remaining workers
+DROP FUNCTION makeReservations(int, varchar(255), varchar(255));
+
+CREATE FUNCTION makeReservations(amount int, clientName varchar(255), reservationType varchar(255),
+    placement varchar(255) DEFAULT 'any', preferredWorker varchar(255) DEFAULT NULL)
+RETURNS TABLE (
+    "SerialID" varchar(255),
+    "Host" varchar(255),
+    "WorkerPort" int
+)
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF placement NOT IN ('any', 'pack', 'spread', 'worker') THEN
+        RAISE EXCEPTION 'Unknown placement %', placement;
+    END IF;
+
+    IF placement = 'worker' AND preferredWorker IS NULL THEN
+        RAISE EXCEPTION 'Worker placement requires a worker';
+    END IF;
+
+    RETURN QUERY
+    WITH candidates AS (
+        SELECT Device.SerialID, Device.Worker,
+            count(*) OVER (PARTITION BY Device.Worker) AS Available,
+            row_number() OVER (PARTITION BY Device.Worker ORDER BY Device.SerialID) AS Position
+        FROM Device
+        INNER JOIN Worker ON Worker.WorkerName = Device.Worker
+        WHERE DeviceStatus = 'available' AND reservationType = ANY(Worker.Reservables)
+    ),
+    picked AS (
+        SELECT Device.SerialID
+        FROM Device
+        INNER JOIN candidates ON candidates.SerialID = Device.SerialID
+        WHERE Device.DeviceStatus = 'available'
+        ORDER BY
+            CASE WHEN placement = 'worker' AND candidates.Worker = preferredWorker THEN 0 ELSE 1 END,
+            CASE WHEN placement = 'spread' THEN candidates.Position ELSE 0 END,
+            CASE WHEN placement IN ('pack', 'worker') AND candidates.Available >= amount THEN candidates.Available END ASC NULLS LAST,
+            CASE WHEN placement IN ('pack', 'worker') THEN candidates.Available ELSE 0 END DESC,
+            candidates.Worker,
+            Device.SerialID
+        LIMIT amount
+        FOR UPDATE OF Device SKIP LOCKED
+    ),
+    reserved AS (
+        UPDATE Device
+        SET DeviceStatus = 'reserved'
+        FROM picked
+        WHERE Device.SerialID = picked.SerialID
+        RETURNING Device.SerialID, Device.Worker
+    ),
+    inserted AS (
+        INSERT INTO Reservations(Device, ClientName, Until)
+        SELECT reserved.SerialID, clientName, CURRENT_TIMESTAMP + interval '1 hour'
+        FROM reserved
+    )
+    SELECT reserved.SerialID, Worker.Host, Worker.ServerPort
+    FROM reserved
+    INNER JOIN Worker ON Worker.WorkerName = reserved.Worker;
+END
+$$;
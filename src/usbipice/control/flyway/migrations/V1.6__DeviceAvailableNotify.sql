@@ -0,0 +1,18 @@
+-- Lets the control wake queued reservations when a device can be reserved,
+-- instead of polling for available devices.
+CREATE FUNCTION notifyDeviceAvailable()
+RETURNS trigger
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    PERFORM pg_notify('device_available', NEW.SerialID);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER DeviceAvailable
+AFTER INSERT OR UPDATE OF DeviceStatus ON Device
+FOR EACH ROW
+WHEN (NEW.DeviceStatus = 'available')
+EXECUTE FUNCTION notifyDeviceAvailable();
@@ -0,0 +1,148 @@
+-- Indexes for the queries that run on every reservation, event and heartbeat poll.
+
+-- handleReservationTimeouts, getReservationsEndingSoon
+CREATE INDEX ReservationsUntil ON Reservations(Until);
+
+-- extendAllReservations, endAllReservations
+CREATE INDEX ReservationsClientName ON Reservations(ClientName);
+
+-- joins from Worker to its devices, handleWorkerTimeouts
+CREATE INDEX DeviceWorker ON Device(Worker);
+
+-- makeReservations only looks at available devices, which are a small part of the table
+CREATE INDEX DeviceAvailable ON Device(Worker, SerialID) WHERE DeviceStatus = 'available';
+
+-- makeReservations reservable type filter
+CREATE INDEX WorkerReservables ON Worker USING GIN (Reservables);
+
+-- The GIN index is only used through array operators, so the reservable type
+-- filter is rewritten from = ANY(Reservables) to Reservables @> ARRAY[type].
+CREATE OR REPLACE FUNCTION makeReservations(amount int, clientName varchar(255), reservationType varchar(255),
+    placement varchar(255) DEFAULT 'any', preferredWorker varchar(255) DEFAULT NULL)
+RETURNS TABLE (
+    "SerialID" varchar(255),
+    "Host" varchar(255),
+    "WorkerPort" int
+)
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF placement NOT IN ('any', 'pack', 'spread', 'worker') THEN
+        RAISE EXCEPTION 'Unknown placement %', placement;
+    END IF;
+
+    IF placement = 'worker' AND preferredWorker IS NULL THEN
+        RAISE EXCEPTION 'Worker placement requires a worker';
+    END IF;
+
+    RETURN QUERY
+    WITH candidates AS (
+        SELECT Device.SerialID, Device.Worker,
+            count(*) OVER (PARTITION BY Device.Worker) AS Available,
+            row_number() OVER (PARTITION BY Device.Worker ORDER BY Device.SerialID) AS Position
+        FROM Device
+        INNER JOIN Worker ON Worker.WorkerName = Device.Worker
+        WHERE DeviceStatus = 'available' AND Worker.Reservables @> ARRAY[reservationType]
+    ),
+    picked AS (
+        SELECT Device.SerialID
+        FROM Device
+        INNER JOIN candidates ON candidates.SerialID = Device.SerialID
+        WHERE Device.DeviceStatus = 'available'
+        ORDER BY
+            CASE WHEN placement = 'worker' AND candidates.Worker = preferredWorker THEN 0 ELSE 1 END,
+            CASE WHEN placement = 'spread' THEN candidates.Position ELSE 0 END,
+            CASE WHEN placement IN ('pack', 'worker') AND candidates.Available >= amount THEN candidates.Available END ASC NULLS LAST,
+            CASE WHEN placement IN ('pack', 'worker') THEN candidates.Available ELSE 0 END DESC,
+            candidates.Worker,
+            Device.SerialID
+        LIMIT amount
+        FOR UPDATE OF Device SKIP LOCKED
+    ),
+    reserved AS (
+        UPDATE Device
+        SET DeviceStatus = 'reserved'
+        FROM picked
+        WHERE Device.SerialID = picked.SerialID
+        RETURNING Device.SerialID, Device.Worker
+    ),
+    inserted AS (
+        INSERT INTO Reservations(Device, ClientName, Until)
+        SELECT reserved.SerialID, clientName, CURRENT_TIMESTAMP + interval '1 hour'
+        FROM reserved
+    )
+    SELECT reserved.SerialID, Worker.Host, Worker.ServerPort
+    FROM reserved
+    INNER JOIN Worker ON Worker.WorkerName = reserved.Worker;
+END
+$$;
+
+-- The existence checks below used NOT IN (SELECT ...), which is planned as a scan of
+-- the whole table on every call. NOT EXISTS is a primary key lookup.
+CREATE OR REPLACE PROCEDURE updateDeviceStatus(deviceserial varchar(255), dstate DeviceState)
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM Device WHERE SerialId = deviceserial) THEN
+        RAISE EXCEPTION 'Device serial does not exist';
+    END IF;
+
+    UPDATE Device
+    SET DeviceStatus = dstate
+    WHERE SerialID = deviceserial;
+END
+$$;
+
+CREATE OR REPLACE PROCEDURE heartbeatWorker(wname varchar(255))
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM Worker WHERE WorkerName = wname) THEN
+        RAISE EXCEPTION 'Worker does not exist';
+    END IF;
+
+    UPDATE Worker
+    SET LastHeartbeat = CURRENT_TIMESTAMP
+    WHERE WorkerName = wname ;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION getDeviceCallBack(deviceserial varchar(255))
+RETURNS TABLE (
+    "ClientId" varchar(255)
+)
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM Device WHERE SerialId = deviceserial) THEN
+        RAISE EXCEPTION 'SerialID does not exist';
+    END IF;
+
+    RETURN QUERY SELECT ClientName FROM Reservations
+    WHERE Device = deviceserial;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION getDeviceWorker(deviceserial varchar(255))
+RETURNS TABLE (
+    "Host" varchar(255),
+    "Serverport" int
+)
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM Device WHERE SerialId = deviceserial) THEN
+        RAISE EXCEPTION 'SerialID does not exist';
+    END IF;
+
+    RETURN QUERY SELECT Worker.Host, Worker.ServerPort
+    FROM Device
+    INNER JOIN Worker ON Device.Worker = Worker.WorkerName
+    WHERE Device.SerialId = deviceserial;
+END
+$$;
@@ -0,0 +1,44 @@
+-- Keeps the control's reservation timers in sync without polling. Payloads carry the
+-- seconds left rather than Until so that the control does not depend on the database clock.
+CREATE FUNCTION notifyReservationChanged()
+RETURNS trigger
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('reservation_changed', json_build_object(
+            'serial', OLD.Device,
+            'op', TG_OP
+        )::text);
+        RETURN OLD;
+    END IF;
+
+    PERFORM pg_notify('reservation_changed', json_build_object(
+        'serial', NEW.Device,
+        'op', TG_OP,
+        'remaining', EXTRACT(EPOCH FROM NEW.Until - LOCALTIMESTAMP)
+    )::text);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER ReservationChanged
+AFTER INSERT OR DELETE OR UPDATE OF Until ON Reservations
+FOR EACH ROW
+EXECUTE FUNCTION notifyReservationChanged();
+
+CREATE FUNCTION getReservationDeadlines()
+RETURNS TABLE (
+    "Device" varchar(255),
+    "Remaining" numeric
+)
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    RETURN QUERY
+    SELECT Reservations.Device, EXTRACT(EPOCH FROM Reservations.Until - LOCALTIMESTAMP)
+    FROM Reservations;
+END
+$$;
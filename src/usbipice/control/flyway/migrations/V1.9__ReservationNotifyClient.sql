@@ -0,0 +1,26 @@
+-- Adds the client to reservation_changed so that event senders can route events
+-- for a serial without looking up its reservation.
+CREATE OR REPLACE FUNCTION notifyReservationChanged()
+RETURNS trigger
+LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('reservation_changed', json_build_object(
+            'serial', OLD.Device,
+            'client', OLD.ClientName,
+            'op', TG_OP
+        )::text);
+        RETURN OLD;
+    END IF;
+
+    PERFORM pg_notify('reservation_changed', json_build_object(
+        'serial', NEW.Device,
+        'client', NEW.ClientName,
+        'op', TG_OP,
+        'remaining', EXTRACT(EPOCH FROM NEW.Until - LOCALTIMESTAMP)
+    )::text);
+    RETURN NEW;
+END
+$$;
@@ -1,6 +1,12 @@
+import asyncio
+import atexit
+import os
+import threading
+from typing import List
+
 import psycopg
 from psycopg.types.enum import Enum, EnumInfo, register_enum
-from typing import List
+from psycopg_pool import AsyncConnectionPool, ConnectionPool, PoolTimeout
 
 class DeviceState(Enum):
     available = 0
@@ -10,22 +16,75 @@ class DeviceState(Enum):
     testing = 4
     broken = 5
 
+POOL_MIN_SIZE = int(os.environ.get("USBIPICE_DATABASE_POOL_MIN") or 1)
+POOL_MAX_SIZE = int(os.environ.get("USBIPICE_DATABASE_POOL_MAX") or 10)
+POOL_CONNECT_TIMEOUT = 10
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def _configure_connection(conn: psycopg.Connection):
+    """Registers the DeviceState enum on every new pooled connection."""
+    info = EnumInfo.fetch(conn, "DeviceState")
+    register_enum(info, conn, DeviceState)
+    conn.commit()
+
+async def _configure_async_connection(conn: psycopg.AsyncConnection):
+    """Registers the DeviceState enum on every new async pooled connection."""
+    info = await EnumInfo.fetch(conn, "DeviceState")
+    register_enum(info, conn, DeviceState)
+    await conn.commit()
+
+def _rows_to_dicts(data: list, columns: List[str], stringify: List[str]) -> list[dict]:
+    """Maps rows to dicts keyed by columns, the columns in stringify are converted to strings."""
+    out = list(map(lambda row : dict(zip(columns, row)), data))
+
+    if stringify:
+        for i, row in enumerate(out):
+            for col in stringify:
+                out[i][col] = str(row[col])
+
+    return out
+
+def get_pool(dburl: str, min_size: int=None, max_size: int=None) -> ConnectionPool:
+    """Returns the process wide connection pool for dburl, creating it on first use. Sizes
+    default to USBIPICE_DATABASE_POOL_MIN and USBIPICE_DATABASE_POOL_MAX and are ignored if the pool
+    already exists. Connections are health checked before being handed out."""
+    with _pools_lock:
+        pool = _pools.get(dburl)
+        if pool:
+            return pool
+
+        pool = ConnectionPool(
+            dburl,
+            min_size=POOL_MIN_SIZE if min_size is None else min_size,
+            max_size=POOL_MAX_SIZE if max_size is None else max_size,
+            configure=_configure_connection,
+            check=ConnectionPool.check_connection,
+            name="usbipice-database",
+            open=False
+        )
+        pool.open()
+        atexit.register(pool.close)
+
+        _pools[dburl] = pool
+        return pool
+
 class Database:
-    """Base database class that syncs postgres enums with psycopg"""
+    """Base database class that syncs postgres enums with psycopg. All instances
+    with the same url share a connection pool."""
     def __init__(self, dburl: str):
         self.url = dburl
+        self.pool = get_pool(dburl)
 
         try:
-            with psycopg.connect(self.url) as conn:
-                info = EnumInfo.fetch(conn, "DeviceState")
-                register_enum(info, conn, DeviceState)
-
-        except Exception:
+            self.pool.wait(timeout=POOL_CONNECT_TIMEOUT)
+        except PoolTimeout:
             raise Exception("Failed to connect to database")
 
     def execute(self, sql: str, args: tuple):
         try:
-            with psycopg.connect(self.url) as conn:
+            with self.pool.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(sql, args)
                     return cur.fetchall()
@@ -34,7 +93,7 @@ class Database:
 
     def proc(self, sql: str, args: tuple):
         try:
-            with psycopg.connect(self.url) as conn:
+            with self.pool.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(sql, args)
         except Exception:
@@ -46,11 +105,69 @@ class Database:
         if (data := self.execute(sql, args)) is False:
             return False
 
-        out = list(map(lambda row : dict(zip(columns, row)), data))
+        return _rows_to_dicts(data, columns, stringify)
+
+class AsyncDatabase:
+    """Asyncio counterpart of Database. The pool is bound to the event loop it is opened
+    on, so open() should be awaited from the loop that serves requests. Queries open the
+    pool on first use if this has not been done."""
+    def __init__(self, dburl: str, min_size: int=None, max_size: int=None):
+        self.url = dburl
+        self.pool = AsyncConnectionPool(
+            dburl,
+            min_size=POOL_MIN_SIZE if min_size is None else min_size,
+            max_size=POOL_MAX_SIZE if max_size is None else max_size,
+            configure=_configure_async_connection,
+            check=AsyncConnectionPool.check_connection,
+            name="usbipice-async-database",
+            open=False
+        )
+        self._opened = False
+        self._open_lock = asyncio.Lock()
 
-        if stringify:
-            for i, row in enumerate(out):
-                for col in stringify:
-                    out[i][col] = str(row[col])
+    async def open(self):
+        async with self._open_lock:
+            if self._opened:
+                return
+
+            try:
+                await self.pool.open(wait=True, timeout=POOL_CONNECT_TIMEOUT)
+            except PoolTimeout:
+                raise Exception("Failed to connect to database")
+
+            self._opened = True
+
+    async def close(self):
+        async with self._open_lock:
+            if not self._opened:
+                return
+
+            await self.pool.close()
+            self._opened = False
+
+    async def execute(self, sql: str, args: tuple):
+        try:
+            await self.open()
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(sql, args)
+                    return await cur.fetchall()
+        except Exception:
+            return False
+
+    async def proc(self, sql: str, args: tuple):
+        try:
+            await self.open()
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(sql, args)
+        except Exception:
+            return False
+
+        return True
+
+    async def getData(self, sql: str, args: tuple, columns: List[str], stringify=[]):
+        if (data := await self.execute(sql, args)) is False:
+            return False
 
-        return out
+        return _rows_to_dicts(data, columns, stringify)
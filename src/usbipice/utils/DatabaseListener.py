@@ -0,0 +1,64 @@
+from __future__ import annotations
+import logging
+import threading
+import time
+from typing import Callable
+
+import psycopg
+
+class DatabaseListenerLogger(logging.LoggerAdapter):
+    def __init__(self, logger, extra=None):
+        super().__init__(logger, extra)
+
+    def process(self, msg, kwargs):
+        return f"[DatabaseListener] {msg}", kwargs
+
+class DatabaseListener:
+    """Receives postgres NOTIFY messages on a dedicated connection and passes them to
+    callback(channel, payload) from the listener thread. Notifications sent while the
+    connection is down are lost, so on_connect is called after every (re)connect to let
+    the owner catch up on missed changes."""
+    def __init__(self, dburl: str, channels: list[str], callback: Callable[[str, str], None],
+                 logger: logging.Logger, on_connect: Callable[[], None]=None, reconnect_seconds: int=5):
+        self.url = dburl
+        self.channels = channels
+        self.callback = callback
+        self.on_connect = on_connect
+        self.reconnect_seconds = reconnect_seconds
+        self.logger = DatabaseListenerLogger(logger)
+
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, daemon=True, name=f"database-listener-{'-'.join(self.channels)}")
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def __listen(self):
+        with psycopg.connect(self.url, autocommit=True) as conn:
+            for channel in self.channels:
+                conn.execute(f"LISTEN {channel}")
+
+            self.logger.info(f"listening on {', '.join(self.channels)}")
+
+            if self.on_connect:
+                self.on_connect()
+
+            while not self.stopped.is_set():
+                # the timeout bounds how long stop() takes to be noticed
+                for notify in conn.notifies(timeout=1):
+                    try:
+                        self.callback(notify.channel, notify.payload)
+                    except Exception as e:
+                        self.logger.error(f"callback failed for {notify.channel}: {e}")
+
+    def __run(self):
+        while not self.stopped.is_set():
+            try:
+                self.__listen()
+            except Exception as e:
+                self.logger.warning(f"connection lost, reconnecting in {self.reconnect_seconds}s: {e}")
+                time.sleep(self.reconnect_seconds)
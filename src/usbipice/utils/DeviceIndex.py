@@ -0,0 +1,72 @@
+from __future__ import annotations
+import threading
+
+import pyudev
+
+from usbipice.utils.dev import get_serial
+
+class DeviceIndex:
+    """Dev files of pico2ice devices by serial. Seeded with a single enumeration of the udev
+    database, then kept current with handleEvent, so that looking up the dev files of a device
+    does not walk every device on the system."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        # serial -> devname -> udev properties
+        self.devs: dict[str, dict[str, dict]] = {}
+        # devname -> serial, remove events do not always carry the serial
+        self.serials: dict[str, str] = {}
+
+    def seed(self, devs=None):
+        """Adds dev files, which are pyudev devices or property dicts. Enumerates the udev database
+        if devs is not given."""
+        if devs is None:
+            devs = pyudev.Context().list_devices()
+
+        for dev in devs:
+            self.handleEvent("add", dev)
+
+    def handleEvent(self, action: str, dev) -> str:
+        """Updates the index with a udev event, returns the serial of the dev file or None if it is
+        not from a pico2ice."""
+        dev = dict(dev)
+        devname = dev.get("DEVNAME")
+
+        if not devname:
+            return None
+
+        with self.lock:
+            if action == "remove":
+                serial = self.serials.pop(devname, None)
+
+                if serial:
+                    files = self.devs.get(serial, {})
+                    files.pop(devname, None)
+
+                    if not files:
+                        self.devs.pop(serial, None)
+
+                return serial
+
+            serial = get_serial(dev)
+
+            if not serial:
+                return None
+
+            # a dev file that was reused by another device
+            previous = self.serials.get(devname)
+            if previous and previous != serial:
+                files = self.devs.get(previous, {})
+                files.pop(devname, None)
+
+                if not files:
+                    self.devs.pop(previous, None)
+
+            self.devs.setdefault(serial, {})[devname] = dev
+            self.serials[devname] = serial
+
+            return serial
+
+    def get(self, serial: str) -> list[dict]:
+        """Returns the udev properties of the dev files of serial."""
+        with self.lock:
+            return list(self.devs.get(serial, {}).values())
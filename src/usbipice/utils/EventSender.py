@@ -1,12 +1,26 @@
 from __future__ import annotations
 import logging
+import os
 import threading
+import time
 import json
+import uuid
+from collections import deque
 
-import psycopg
 from flask_socketio import SocketIO
 
-from usbipice.utils import Database
+from usbipice.utils import Database, DatabaseListener
+from usbipice.utils.SessionQueue import SessionQueue
+from usbipice.utils.web import SyncAsyncServer
+
+# events sent in one batch frame are at most this many bytes, larger events are sent alone
+BATCH_MAX_BYTES = 256 * 1024
+# seconds a batching session waits after an event for more events to send with it
+BATCH_LINGER_SECONDS = 0.005
+# clients that reconnect after being disconnected this long get a summary of their queued events
+SESSION_SUMMARY_SECONDS = int(os.environ.get("USBIPICE_SESSION_SUMMARY_SECONDS") or 30)
+# bytes of sent events kept until the client acknowledges them
+SESSION_UNACKED_BYTES = int(os.environ.get("USBIPICE_SESSION_UNACKED_BYTES") or 4 * 1024 * 1024)
 
 class EventSenderLogger(logging.LoggerAdapter):
     def __init__(self, logger, extra=None):
@@ -23,18 +37,82 @@ class SessionLogger(logging.LoggerAdapter):
     def process(self, msg, kwargs):
         return f"[{self.client_id}] {msg}", kwargs
 
+class LingerFlusher:
+    """Flushes batching sessions BATCH_LINGER_SECONDS after they are scheduled, on one thread shared
+    by all sessions of an EventSender."""
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+        self.cv = threading.Condition()
+        # (deadline, session), the linger is the same for every session so deadlines are in order
+        self.due: deque[tuple[float, Session]] = deque()
+        self.thread = None
+
+    def schedule(self, session: Session):
+        with self.cv:
+            if not self.thread:
+                self.thread = threading.Thread(target=self.__run, daemon=True, name="event-linger-flush")
+                self.thread.start()
+
+            self.due.append((time.monotonic() + BATCH_LINGER_SECONDS, session))
+            self.cv.notify()
+
+    def __run(self):
+        while True:
+            with self.cv:
+                while not self.due:
+                    self.cv.wait()
+
+                deadline, session = self.due[0]
+                wait = deadline - time.monotonic()
+
+                if wait > 0:
+                    self.cv.wait(wait)
+                    continue
+
+                self.due.popleft()
+
+            try:
+                session.lingerFlush()
+            except Exception as e:
+                self.logger.error(f"failed to flush session {session.client_id}: {e}")
+
 class Session:
+    """Queues events for a client and sends them to its socket. Sockets that connect with batching
+    enabled receive pending events as 'events' frames holding a json array, events sent within
+    BATCH_LINGER_SECONDS of each other are sent together. The queue is bounded, see SessionQueue,
+    and a client that was disconnected for SESSION_SUMMARY_SECONDS receives a summary of it.
+
+    Sent events are numbered with a seq field and kept until the client acknowledges them, up to
+    SESSION_UNACKED_BYTES. On connect, the session id and last seq are sent as a 'session' event.
+    A client that reconnects with resume set to the session id and the last seq it handled is sent
+    the unacknowledged events after that seq again."""
     def __init__(self, socketio: SocketIO, event_sender, logger: logging.Logger, client_id: str):
         self.socketio = socketio
         self.event_sender = event_sender
         self.logger = SessionLogger(logger, client_id)
         self.client_id = client_id
+        self.id = uuid.uuid4().hex
 
         self.sock_id = None
-        self.message_queue = []
+        self.batch = False
+        self.queue = SessionQueue()
+        self.disconnected_at = None
+
+        self.seq = 0
+        # (seq, message) of sent events that have not been acknowledged
+        self.unacked: deque[tuple[int, str]] = deque()
+        self.unacked_size = 0
+        self.unacked_evicted = 0
+        # unacknowledged events to send again on the next flush
+        self.resend: list[str] = []
+        self.announce = False
 
         self.lock = threading.Lock()
+        # keeps concurrent flushes in order
+        self.flush_lock = threading.Lock()
         self.timeout = None
+        # whether a flush is scheduled with the linger flusher
+        self.lingering = False
 
         self.startTimeout()
 
@@ -56,12 +134,50 @@ class Session:
 
     def send(self, data: str):
         with self.lock:
-            self.message_queue.append(data)
+            if not self.queue.put(data) and self.queue.dropped % 1000 == 1:
+                self.logger.warning(f"event queue is full, dropped {self.queue.dropped} events")
+
+            if not self.sock_id:
+                # sent when a socket connects
+                return
+
+            if self.batch and self.sock_id:
+                # flushed when the linger window ends, coalescing bursts
+                if not self.lingering:
+                    self.lingering = True
+                    self.event_sender.flusher.schedule(self)
+                return
+
         self.flush()
 
-    def setSocket(self, sock_id):
+    def lingerFlush(self):
+        """Called by the linger flusher once the linger window ends."""
+        with self.lock:
+            self.lingering = False
+
+        self.flush()
+
+    def setSocket(self, sock_id, batch: bool=False, resume: dict=None):
         with self.lock:
             self.sock_id = sock_id
+            self.batch = batch
+            self.announce = True
+            self.resend = []
+
+            if isinstance(resume, dict) and resume.get("session") == self.id and isinstance(resume.get("seq"), int):
+                self.__ack(resume["seq"])
+                self.resend = [message for _, message in self.unacked]
+
+                if self.resend:
+                    self.logger.info(f"resending {len(self.resend)} events after {resume['seq']}")
+
+            summarize = self.disconnected_at is not None and time.monotonic() - self.disconnected_at >= SESSION_SUMMARY_SECONDS
+            self.disconnected_at = None
+
+            if summarize and len(self.queue):
+                queued = len(self.queue)
+                self.queue.summarize()
+                self.logger.info(f"summarized {queued} queued events as {len(self.queue)}")
         self.logger.info("socket connected")
 
         self.stopTimeout()
@@ -70,35 +186,134 @@ class Session:
     def removeSocket(self):
         with self.lock:
             self.sock_id = None
+            self.disconnected_at = time.monotonic()
         self.logger.info("socket disconnected")
 
         self.startTimeout()
 
-    def flush(self):
+    def __ack(self, seq: int):
+        """Should be called with the lock held."""
+        while self.unacked and self.unacked[0][0] <= seq:
+            _, message = self.unacked.popleft()
+            self.unacked_size -= len(message)
+
+    def ack(self, seq: int):
+        """Drops sent events up to and including seq, the client has handled them."""
         with self.lock:
-            if not self.message_queue:
-                return
+            self.__ack(seq)
 
-            if not self.sock_id:
-                self.logger.warning("no socket to flush to")
-                return
+    def __sequence(self, message: str) -> str:
+        """Numbers a message and keeps it until it is acknowledged. Should be called with the lock held."""
+        self.seq += 1
+        # messages are json objects, so the seq field can be spliced in
+        message = f'{{"seq":{self.seq},{message[1:]}'
+
+        self.unacked.append((self.seq, message))
+        self.unacked_size += len(message)
+
+        while self.unacked_size > SESSION_UNACKED_BYTES and len(self.unacked) > 1:
+            _, evicted = self.unacked.popleft()
+            self.unacked_size -= len(evicted)
+            self.unacked_evicted += 1
 
-            messages, self.message_queue = self.message_queue, []
-            sock_id = self.sock_id
+        return message
+
+    def __frames(self, messages: list[str]) -> list[list[str]]:
+        """Groups messages into frames of at most BATCH_MAX_BYTES. A message larger than that is
+        sent in a frame of its own."""
+        frames = []
+        size = 0
 
         for message in messages:
+            if not frames or size + len(message) + 1 > BATCH_MAX_BYTES:
+                frames.append([])
+                size = 1
+
+            frames[-1].append(message)
+            size += len(message) + 1
+
+        return frames
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.sock_id:
+                    return
+
+                if not len(self.queue) and not self.resend and not self.announce:
+                    return
+
+                announce = self.announce
+                self.announce = False
+                # the last seq sent before this flush
+                session = {"session": self.id, "seq": self.seq}
+
+                messages = self.resend + [self.__sequence(message) for message in self.queue.drain()]
+                self.resend = []
+                sock_id = self.sock_id
+                batch = self.batch
+
+            if batch:
+                # messages are json already, so joining them gives a json array
+                event = "events"
+                payloads = [f"[{','.join(frame)}]" for frame in self.__frames(messages)]
+            else:
+                event = "event"
+                payloads = messages
+
+            if isinstance(self.socketio, SyncAsyncServer):
+                # queued on the event loop, which sends them in order
+                if announce:
+                    self.socketio.emit("session", session, to=sock_id)
+
+                self.socketio.emit_many(event, payloads, to=sock_id)
+                self.logger.debug(f"flushed {len(messages)} events in {len(payloads)} frames")
+                return
+
             try:
-                self.socketio.emit("event", message, to=sock_id)
-                self.socketio.sleep(0)
+                if announce:
+                    self.socketio.emit("session", session, to=sock_id)
+
+                for payload in payloads:
+                    self.socketio.emit(event, payload, to=sock_id)
+                    self.socketio.sleep(0)
             except Exception:
+                # unsent events are still unacknowledged, so a resuming client receives them
                 self.logger.warning("socket disconnected during flush")
-                with self.lock:
-                    self.message_queue.append(message)
-                    return
+                return
+
+            self.logger.debug(f"flushed {len(messages)} events in {len(payloads)} frames")
+
+    def close(self) -> int:
+        """Stops the timers and discards queued events, returns how many were discarded."""
+        with self.lock:
+            if self.timeout:
+                self.timeout.cancel()
+
+            # a scheduled linger flush has nothing to send to
+            self.sock_id = None
+
+            self.unacked.clear()
+            self.unacked_size = 0
+            self.resend = []
+
+            return self.queue.close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = self.queue.stats()
+            stats["seq"] = self.seq
+            stats["unacked"] = len(self.unacked)
+            stats["unacked_bytes"] = self.unacked_size
+            stats["unacked_evicted"] = self.unacked_evicted
 
-        self.logger.debug(f"flushed {len(messages)} events")
+            return stats
 
 class EventSender(Database):
+    """Sends events to client sessions. The client of a reserved serial is looked up in an
+    in memory routing table, which is filled when reservations are made and cleared when they
+    end. Routes are also kept in sync with reservation_changed notifications once start() is
+    called, and are looked up in the database when missing."""
     def __init__(self, socketio: SocketIO, dburl: str, logger: logging.Logger):
         super().__init__(dburl)
         self.socketio = socketio
@@ -106,6 +321,61 @@ class EventSender(Database):
 
         self.sessions: dict[str, Session] = {}
         self.lock = threading.Lock()
+        self.flusher = LingerFlusher(self.logger)
+        # events dropped by sessions that have ended
+        self.ended_dropped = 0
+
+        self.routes: dict[str, str] = {}
+        # incremented whenever routes are removed, so that database lookups that
+        # started before a removal do not add a stale route
+        self.route_generation = 0
+        self.route_lock = threading.Lock()
+
+        # whether notifications for a serial are routed, None routes all of them
+        self.owns = None
+
+        self.listener = DatabaseListener(dburl, ["reservation_changed"], self.__onReservationChanged, logger, on_connect=self.clearRoutes)
+
+    def start(self, owns=None):
+        """Starts keeping routes in sync with reservation changes made elsewhere. If owns is given,
+        only changes to serials for which owns(serial) is true are kept, other serials are looked
+        up when needed."""
+        self.owns = owns
+        self.listener.start()
+
+    def setRoute(self, serial: str, client_id: str):
+        """Routes events for serial to client_id."""
+        with self.route_lock:
+            self.routes[serial] = client_id
+
+    def clearRoute(self, serial: str):
+        """Removes the route for serial after its reservation ends."""
+        with self.route_lock:
+            self.routes.pop(serial, None)
+            self.route_generation += 1
+
+    def clearRoutes(self):
+        """Removes all routes, they are looked up again when needed."""
+        with self.route_lock:
+            self.routes = {}
+            self.route_generation += 1
+
+    def __onReservationChanged(self, channel, payload):
+        try:
+            msg = json.loads(payload)
+            serial = msg["serial"]
+            op = msg["op"]
+        except Exception:
+            self.logger.error(f"bad reservation notification {payload}")
+            return
+
+        if self.owns and not self.owns(serial):
+            return
+
+        if op == "DELETE":
+            self.clearRoute(serial)
+        elif op == "INSERT":
+            self.setRoute(serial, msg["client"])
 
     def startSession(self, client_id):
         with self.lock:
@@ -116,9 +386,20 @@ class EventSender(Database):
 
         self.logger.info(f"started session {client_id}")
 
-    def addSocket(self, sock_id, client_id: str):
+    def addSocket(self, sock_id, client_id: str, batch: bool=False, resume: dict=None):
+        """Sends client_id's events to sock_id. If batch is set, events are sent in 'events'
+        frames holding json arrays. resume is the {session, seq} of the last event the client
+        handled, unacknowledged events after it are sent again."""
         session = self.startSession(client_id)
-        session.setSocket(sock_id)
+        session.setSocket(sock_id, batch, resume)
+
+    def ack(self, client_id: str, seq: int):
+        """Marks the events of client_id's session up to seq as handled."""
+        with self.lock:
+            session = self.sessions.get(client_id)
+
+        if session:
+            session.ack(seq)
 
     def removeSocket(self, client_id):
         with self.lock:
@@ -131,12 +412,44 @@ class EventSender(Database):
 
     def endSession(self, client_id):
         with self.lock:
-            self.sessions.pop(client_id, None)
+            session = self.sessions.pop(client_id, None)
+
+        if not session:
+            return
+
+        dropped = session.stats()["dropped"]
+        if discarded := session.close():
+            self.logger.warning(f"session {client_id} ended with {discarded} undelivered events")
+
+        with self.lock:
+            self.ended_dropped += dropped + discarded
+
+    def queueStats(self) -> dict:
+        """Returns the queue stats of each session, along with the total queue depth and the
+        total amount of events dropped, including those of ended sessions."""
+        with self.lock:
+            sessions = dict(self.sessions)
+            dropped = self.ended_dropped
+
+        stats = {client_id: session.stats() for client_id, session in sessions.items()}
+
+        return {
+            "depth": sum(session["depth"] for session in stats.values()),
+            "dropped": dropped + sum(session["dropped"] for session in stats.values()),
+            "sessions": stats
+        }
 
     def __getReservationClientId(self, serial: str):
-        """Returns the event server url for a device, None if there is none, or False on error."""
+        """Returns the client id of the reservation on a device, None if there is none, or False on error."""
+        with self.route_lock:
+            client_id = self.routes.get(serial)
+            generation = self.route_generation
+
+        if client_id:
+            return client_id
+
         try:
-            with psycopg.connect(self.url) as conn:
+            with self.pool.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute("SELECT * FROM getDeviceCallback(%s::varchar(255))", (serial,))
                     data = cur.fetchall()
@@ -148,7 +461,13 @@ class EventSender(Database):
             # no reservation
             return None
 
-        return data[0][0]
+        client_id = data[0][0]
+
+        with self.route_lock:
+            if generation == self.route_generation:
+                self.routes[serial] = client_id
+
+        return client_id
 
     def sendClient(self, client_id: str, contents: str):
         session = self.startSession(client_id)
@@ -5,6 +5,7 @@ import os
 import pyudev
 
 from usbipice.utils.dev import *
+from usbipice.utils.DeviceIndex import DeviceIndex
 
 class Device:
     def __init__(self, serial, firmware_path, flasher):
@@ -61,6 +62,9 @@ class FirmwareFlasher:
         if not os.path.exists("client_media"):
             os.mkdir("client_media")
 
+        self.index = DeviceIndex()
+        self.index.seed()
+
         context = pyudev.Context()
         monitor = pyudev.Monitor.from_netlink(context)
         self.observer = pyudev.MonitorObserver(monitor, self.__handle_event, name="flash-observer")
@@ -72,6 +76,8 @@ class FirmwareFlasher:
 
     def __handle_event(self, action, dev):
         """Reroutes events to corresponding Device objects."""
+        self.index.handleEvent(action, dev)
+
         if action != "add":
             return
 
@@ -110,13 +116,9 @@ class FirmwareFlasher:
             for serial in serials:
                 self.remaining_serials[serial] = Device(serial, path, self)
 
-        info = get_devs()
         devs = []
-
-        for serial, path in info.items():
-            if serial in serials:
-                devs.extend(path)
-
+        for serial in serials:
+            devs.extend(self.index.get(serial))
 
         for file in devs:
             if file.get("SUBSYSTEM") != "tty":
@@ -0,0 +1,105 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_MAX_CONCURRENCY = int(os.environ.get("USBIPICE_HTTP_MAX_CONCURRENCY") or 64)
+HTTP_POOL_HOSTS = int(os.environ.get("USBIPICE_HTTP_POOL_HOSTS") or 128)
+HTTP_POOL_PER_HOST = int(os.environ.get("USBIPICE_HTTP_POOL_PER_HOST") or 16)
+HTTP_CONNECT_RETRIES = int(os.environ.get("USBIPICE_HTTP_CONNECT_RETRIES") or 2)
+HTTP_BACKOFF_SECONDS = float(os.environ.get("USBIPICE_HTTP_BACKOFF_SECONDS") or 0.2)
+
+class CountingAdapter(HTTPAdapter):
+    """HTTPAdapter that counts the requests it sends and the connections its pools open."""
+    def __init__(self, *args, **kwargs):
+        self.counter_lock = threading.Lock()
+        self.requests_sent = 0
+        self.connections = 0
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+
+        adapter = self
+
+        def counted(pool_cls):
+            class CountingConnection(pool_cls.ConnectionCls):
+                def connect(self):
+                    super().connect()
+
+                    with adapter.counter_lock:
+                        adapter.connections += 1
+
+            return type(pool_cls.__name__, (pool_cls,), {"ConnectionCls": CountingConnection})
+
+        pool_classes = self.poolmanager.pool_classes_by_scheme
+        self.poolmanager.pool_classes_by_scheme = {scheme: counted(cls) for scheme, cls in pool_classes.items()}
+
+    def send(self, request, *args, **kwargs):
+        with self.counter_lock:
+            self.requests_sent += 1
+
+        return super().send(request, *args, **kwargs)
+
+    def counters(self) -> tuple[int, int]:
+        """Returns the amount of requests sent and connections opened."""
+        with self.counter_lock:
+            return self.requests_sent, self.connections
+
+class HttpTransport:
+    """Sends HTTP requests over keep-alive connections, pooled per host. At most max_concurrency
+    requests are in flight at once. Requests that fail to connect are retried with exponential
+    backoff, other failures are not retried since most endpoints are not idempotent."""
+    def __init__(self, max_concurrency: int=HTTP_MAX_CONCURRENCY, pool_hosts: int=HTTP_POOL_HOSTS,
+                 pool_per_host: int=HTTP_POOL_PER_HOST, connect_retries: int=HTTP_CONNECT_RETRIES,
+                 backoff_seconds: float=HTTP_BACKOFF_SECONDS):
+        retry = Retry(
+            total=connect_retries,
+            connect=connect_retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=backoff_seconds,
+            raise_on_status=False
+        )
+
+        self.adapter = CountingAdapter(pool_connections=pool_hosts, pool_maxsize=pool_per_host, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends a request, accepts the same arguments as requests.request."""
+        with self.semaphore:
+            return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def stats(self) -> dict:
+        """Returns the amount of requests sent, connections opened and requests that reused
+        an open connection."""
+        requests_sent, connections = self.adapter.counters()
+
+        return {
+            "requests": requests_sent,
+            "connections": connections,
+            "reused": max(0, requests_sent - connections)
+        }
+
+_transport: HttpTransport = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> HttpTransport:
+    """Returns the process wide HttpTransport, creating it on first use."""
+    global _transport
+
+    with _transport_lock:
+        if _transport is None:
+            _transport = HttpTransport()
+
+        return _transport
@@ -3,7 +3,7 @@ import time
 import logging
 from logging import Logger
 
-import requests
+from usbipice.utils.HttpTransport import get_transport
 
 class RemoteLogger:
     """Drop in replacement for a logging.Logger to also post to logs control server."""
@@ -13,6 +13,7 @@ class RemoteLogger:
         self.control_server = control_server
         self.client_name = client_name
         self.interval = interval
+        self.transport = get_transport()
 
         self._backlog = []
         self._backlog_lock = threading.Lock()
@@ -31,7 +32,7 @@ class RemoteLogger:
                 continue
 
             try:
-                res = requests.get(f"{self.control_server}/log", json={
+                res = self.transport.get(f"{self.control_server}/log", json={
                     "logs": logs,
                     "name": self.client_name
                 }, timeout=10)
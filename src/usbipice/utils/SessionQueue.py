@@ -0,0 +1,149 @@
+from __future__ import annotations
+from collections import deque
+import json
+import os
+import tempfile
+
+SESSION_QUEUE_MEMORY_BYTES = int(os.environ.get("USBIPICE_SESSION_QUEUE_MEMORY_BYTES") or 1024 * 1024)
+SESSION_QUEUE_SPILL_BYTES = int(os.environ.get("USBIPICE_SESSION_QUEUE_SPILL_BYTES") or 64 * 1024 * 1024)
+SESSION_QUEUE_SPILL_DIR = os.environ.get("USBIPICE_SESSION_QUEUE_SPILL_DIR") or None
+# events that report the current state of a device, only the latest of them matters to a client
+# that was away for a while
+SUMMARIZED_EVENTS = {"initialized", "reservation ending soon", "export", "disconnect"}
+
+class SessionQueue:
+    """First in first out queue of json encoded events for a session. The first memory_bytes of
+    events are held in memory, later events are appended to a spill file until it holds spill_bytes,
+    after which new events are dropped. Not thread safe."""
+    def __init__(self, memory_bytes: int=SESSION_QUEUE_MEMORY_BYTES, spill_bytes: int=SESSION_QUEUE_SPILL_BYTES,
+                 spill_dir: str=SESSION_QUEUE_SPILL_DIR):
+        self.memory_bytes = memory_bytes
+        self.spill_bytes = spill_bytes
+        self.spill_dir = spill_dir
+
+        self.memory: deque[str] = deque()
+        self.memory_size = 0
+
+        self.spill_file = None
+        self.spill_size = 0
+        self.spilled = 0
+
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.memory) + self.spilled
+
+    def put(self, message: str) -> bool:
+        """Queues a message, returns False if it was dropped."""
+        # once spilling, messages go to the file until it is drained so that order is kept
+        if not self.spill_file and self.memory_size + len(message) <= self.memory_bytes:
+            self.memory.append(message)
+            self.memory_size += len(message)
+            return True
+
+        if self.spill_size + len(message) + 1 > self.spill_bytes:
+            self.dropped += 1
+            return False
+
+        try:
+            if not self.spill_file:
+                self.spill_file = tempfile.TemporaryFile(mode="w+", dir=self.spill_dir, prefix="usbipice-session-")
+
+            # events are json, which has no raw newlines
+            self.spill_file.write(message + "\n")
+        except Exception:
+            self.dropped += 1
+            return False
+
+        self.spill_size += len(message) + 1
+        self.spilled += 1
+        return True
+
+    def drain(self) -> list[str]:
+        """Removes and returns all queued messages."""
+        messages = list(self.memory)
+        self.memory.clear()
+        self.memory_size = 0
+
+        if self.spill_file:
+            try:
+                self.spill_file.flush()
+                self.spill_file.seek(0)
+                messages.extend(line.rstrip("\n") for line in self.spill_file)
+            except Exception:
+                self.dropped += self.spilled
+
+            self.__closeSpill()
+
+        return messages
+
+    def summarize(self):
+        """Replaces the queue with a summary. Of the events in SUMMARIZED_EVENTS, which report state,
+        only the latest of each kind for each serial is kept. Other events, such as results, are all
+        kept. Events stay in the order they were queued, preceded by a 'missed events' event with the
+        amount of events left out for each serial."""
+        messages = []
+        # (serial, event) -> index in messages of the latest event
+        latest = {}
+        missed = {}
+
+        for message in self.drain():
+            try:
+                msg = json.loads(message)
+                key = (msg["serial"], msg["contents"]["event"])
+            except Exception:
+                continue
+
+            if key[1] in SUMMARIZED_EVENTS:
+                if key in latest:
+                    missed[key[0]] = missed.get(key[0], 0) + 1
+                    messages[latest[key]] = None
+
+                latest[key] = len(messages)
+
+            messages.append(message)
+
+        for serial, amount in missed.items():
+            self.put(json.dumps({
+                "serial": serial,
+                "contents": {
+                    "event": "missed events",
+                    "serial": serial,
+                    "missed": amount
+                }
+            }))
+
+        for message in messages:
+            if message is not None:
+                self.put(message)
+
+    def close(self) -> int:
+        """Discards queued messages, returns how many there were."""
+        amount = len(self)
+
+        self.memory.clear()
+        self.memory_size = 0
+        self.__closeSpill()
+
+        return amount
+
+    def __closeSpill(self):
+        if self.spill_file:
+            try:
+                self.spill_file.close()
+            except Exception:
+                pass
+
+        self.spill_file = None
+        self.spill_size = 0
+        self.spilled = 0
+
+    def stats(self) -> dict:
+        """Returns the amount of queued messages, how many of them are spilled to disk, the bytes
+        held in memory and the amount of dropped messages."""
+        return {
+            "depth": len(self),
+            "spilled": self.spilled,
+            "memory_bytes": self.memory_size,
+            "dropped": self.dropped
+        }
@@ -1,5 +1,9 @@
-from usbipice.utils.Database import Database, DeviceState
+from usbipice.utils.Database import Database, AsyncDatabase, DeviceState
+from usbipice.utils.DatabaseListener import DatabaseListener
+from usbipice.utils.HttpTransport import HttpTransport, get_transport
+from usbipice.utils.DeviceIndex import DeviceIndex
 from usbipice.utils.FirmwareFlasher import FirmwareFlasher
 from usbipice.utils.RemoteLogger import RemoteLogger
+from usbipice.utils.SessionQueue import SessionQueue
 from usbipice.utils.EventSender import EventSender
 from usbipice.utils.utils import *
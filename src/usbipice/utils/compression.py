@@ -0,0 +1,67 @@
+"""
+Compression of bytes in socket payloads. Bytes are replaced with {"zlib": compressed, "size": n}
+dicts, which receivers decompress where the data is used.
+"""
+import zlib
+from typing import BinaryIO
+
+# bytes shorter than this are sent as is
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+# decompressed data is produced this many bytes at a time
+DECOMPRESS_CHUNK_BYTES = 64 * 1024
+# a single compressed value may not decompress to more than this, bitstreams are about 104KB
+MAX_DECOMPRESSED_BYTES = 8 * 1024 * 1024
+
+def compress_payload(value):
+    """Returns value with bytes inside of dicts and lists replaced by their compressed form. Bytes
+    that are short or do not compress are left as is."""
+    if isinstance(value, dict):
+        return {key: compress_payload(item) for key, item in value.items()}
+
+    if isinstance(value, list):
+        return [compress_payload(item) for item in value]
+
+    if isinstance(value, bytes) and len(value) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(value, COMPRESS_LEVEL)
+        if len(compressed) < len(value):
+            return {"zlib": compressed, "size": len(value)}
+
+    return value
+
+def is_compressed(value) -> bool:
+    """Returns whether value is a compressed form created by compress_payload."""
+    return isinstance(value, dict) and isinstance(value.get("zlib"), bytes) and set(value) <= {"zlib", "size"}
+
+def decompress_to(value: dict, f: BinaryIO, max_size: int=MAX_DECOMPRESSED_BYTES) -> int:
+    """Decompresses a value created by compress_payload into f, a chunk at a time. Raises ValueError if
+    the data is invalid or decompresses to more than max_size bytes. Returns the amount of bytes written."""
+    decompressor = zlib.decompressobj()
+    data = value["zlib"]
+    written = 0
+
+    try:
+        while data:
+            chunk = decompressor.decompress(data, DECOMPRESS_CHUNK_BYTES)
+            data = decompressor.unconsumed_tail
+
+            written += len(chunk)
+            if written > max_size:
+                raise ValueError(f"decompresses to more than {max_size} bytes")
+
+            f.write(chunk)
+
+        chunk = decompressor.flush()
+    except zlib.error as e:
+        raise ValueError(f"invalid compressed data: {e}")
+
+    written += len(chunk)
+    if written > max_size:
+        raise ValueError(f"decompresses to more than {max_size} bytes")
+
+    f.write(chunk)
+
+    if not decompressor.eof:
+        raise ValueError("truncated compressed data")
+
+    return written
@@ -104,6 +104,19 @@ def get_devs():
         out[serial].append(dev)
     return out
 
+def get_hub(dev: pyudev.Device) -> str:
+    """Returns the sys name of the USB hub that the device behind a dev file is plugged into,
+    or None if it is not a USB device."""
+    usb = dev.find_parent("usb", "usb_device")
+    if usb is None:
+        return None
+
+    hub = usb.find_parent("usb", "usb_device")
+    if hub is None:
+        return None
+
+    return hub.sys_name
+
 def get_dev_paths():
     """Returns a dict mapping device serials to list of dev paths. This operation 
     looks through all available dev files and is intended to be only used once after reserving devices.
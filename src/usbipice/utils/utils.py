@@ -67,7 +67,8 @@ def get_ip() -> str:
 
 def typecheck(fn, args) -> bool:
     """Checks whether args are valid types for fn. Only works on classes
-    and non nested list generics. For dict, only checks if arg is a dict."""
+    and non nested list generics. For dict, only checks if arg is a dict.
+    Arguments equal to the parameter default are always accepted."""
     params = inspect.signature(fn).parameters.values()
 
     if len(params) != len(args):
@@ -79,6 +80,9 @@ def typecheck(fn, args) -> bool:
         if annotation is inspect._empty:
             continue
 
+        if param.default is not inspect._empty and arg == param.default:
+            continue
+
         if inspect.isclass(annotation):
             if not isinstance(arg, annotation):
                 return False
@@ -105,8 +109,8 @@ def typecheck(fn, args) -> bool:
 
     return True
 
-def json_to_args(json, parameters):
-    values = list(map(json.get, parameters))
+def json_to_args(json, parameters, defaults={}):
+    values = list(map(lambda x : json.get(x, defaults.get(x)), parameters))
     if any(map(lambda x : x is None, parameters)):
         return False
 
@@ -1,5 +1,8 @@
 import asyncio
 import inspect
+import json
+import threading
+import time
 from functools import wraps
 
 from flask import Response, jsonify, request
@@ -9,13 +12,17 @@ from usbipice.utils.utils import json_to_args, typecheck
 
 def inject_and_return_json(func):
     """Injects request json values into arguments. Uses argument names as the json key. Typechecks arguments,
-    only classes are supported. Returns a status=400 if a key is missing or the typecheck fails.
+    only classes are supported. Keys for arguments with defaults may be omitted.
+    Returns a status=400 if a key is missing or the typecheck fails.
     Returns status=200 on True and status=500 on false. Otherwise, returns flask.jsonify of the result."""
     parameter_strings = [] # func args as string
+    defaults = {}
     parameters = inspect.signature(func).parameters.values()
 
     for param in parameters:
         parameter_strings.append(param.name)
+        if param.default is not inspect._empty:
+            defaults[param.name] = param.default
 
     @wraps(func)
     def handler_wrapper(*args):
@@ -26,7 +33,7 @@ def inject_and_return_json(func):
         except Exception:
             return Response(status=400)
 
-        args = json_to_args(json, parameter_strings)
+        args = json_to_args(json, parameter_strings, defaults)
 
         if not typecheck(func, args):
             return Response(status=400)
@@ -42,6 +49,91 @@ def inject_and_return_json(func):
     return handler_wrapper
 
 
+def async_inject_and_return_json(func):
+    """Coroutine version of inject_and_return_json for AsyncRouter routes. The wrapped function
+    receives the decoded json body of the request and returns (status, body)."""
+    parameter_strings = [] # func args as string
+    defaults = {}
+    parameters = inspect.signature(func).parameters.values()
+
+    for param in parameters:
+        parameter_strings.append(param.name)
+        if param.default is not inspect._empty:
+            defaults[param.name] = param.default
+
+    @wraps(func)
+    async def handler_wrapper(content_type, body):
+        if content_type != "application/json":
+            return 400, None
+        try:
+            data = json.loads(body)
+        except Exception:
+            return 400, None
+
+        if not isinstance(data, dict):
+            return 400, None
+
+        args = json_to_args(data, parameter_strings, defaults)
+
+        if not typecheck(func, args):
+            return 400, None
+
+        res = await func(*args)
+        if res is True or res is None:
+            return 200, None
+        if res is False:
+            return 500, None
+
+        return 200, res
+
+    return handler_wrapper
+
+class AsyncRouter:
+    """ASGI app that serves routes with coroutines on the event loop. Requests to paths that
+    are not registered are passed to fallback, which is typically the WsgiToAsgi wrapped Flask app."""
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.routes = {}
+
+    def get(self, path: str):
+        """Registers a GET route. Should be used on top of async_inject_and_return_json."""
+        def register(func):
+            self.routes[("GET", path)] = func
+            return func
+
+        return register
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (route := self.routes.get((scope["method"], scope["path"]))) is None:
+            return await self.fallback(scope, receive, send)
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+
+            if not message.get("more_body"):
+                break
+
+        content_type = None
+        for key, value in scope["headers"]:
+            if key == b"content-type":
+                content_type = value.decode("latin-1").split(";")[0].strip()
+
+        status, res = await route(content_type, body)
+
+        headers = []
+        if res is not None:
+            res = json.dumps(res).encode()
+            headers.append((b"content-type", b"application/json"))
+        else:
+            res = b""
+
+        headers.append((b"content-length", str(len(res)).encode()))
+
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": res})
+
 def flask_socketio_adapter_connect(func):
     """Adapter to allow flask_socketio.SocketIO eventhandlers to use the same interface as
     socketio.AsyncServer for @socketio.on("connect"). This is
@@ -72,9 +164,102 @@ def flask_socketio_adapter_on(func):
 
 class SyncAsyncServer(AsyncServer):
     """Adapter to allow flask_socketio.SocketIO to have the same interface as socketio.AsyncServer while
-    running as an ASGI app"""
+    running as an ASGI app. Emits may be called from any thread, they are queued and sent in order by a
+    task on the event loop that serves the sockets, which is captured on the first request."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop: asyncio.AbstractEventLoop = None
+        self.emit_queue: asyncio.Queue = None
+        # emits made before the loop is captured
+        self.pending_emits = []
+        self.attach_lock = threading.Lock()
+
+        self.stats_lock = threading.Lock()
+        self.emitted = 0
+        self.emit_latency_total = 0
+        self.emit_latency_max = 0
+
+    async def handle_request(self, *args, **kwargs):
+        if self.loop is None:
+            self.__attach()
+
+        return await super().handle_request(*args, **kwargs)
+
+    def __attach(self):
+        """Captures the running loop and starts the task that sends queued emits."""
+        with self.attach_lock:
+            if self.loop is not None:
+                return
+
+            self.emit_queue = asyncio.Queue()
+            for batch in self.pending_emits:
+                self.emit_queue.put_nowait(batch)
+            self.pending_emits = []
+
+            self.loop = asyncio.get_running_loop()
+            self.drain_task = self.loop.create_task(self.__drain())
+
+    def __enqueue(self, batch: list):
+        with self.attach_lock:
+            if self.loop is None:
+                self.pending_emits.append(batch)
+                return
+
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+
+        if on_loop:
+            self.emit_queue.put_nowait(batch)
+        else:
+            self.loop.call_soon_threadsafe(self.emit_queue.put_nowait, batch)
+
+    async def __drain(self):
+        while True:
+            batch = await self.emit_queue.get()
+
+            for queued, event, data, kwargs in batch:
+                try:
+                    await super().emit(event, data, **kwargs)
+                except Exception as e:
+                    self.logger.warning(f"failed to emit {event}: {e}")
+
+                latency = time.perf_counter() - queued
+                with self.stats_lock:
+                    self.emitted += 1
+                    self.emit_latency_total += latency
+                    self.emit_latency_max = max(self.emit_latency_max, latency)
+
     def emit(self, event, data=None, to=None, room=None, skip_sid=None, namespace=None, callback=None, ignore_queue=False):
-        return asyncio.run(super().emit(event, data, to, room, skip_sid, namespace, callback, ignore_queue))
+        """Queues an emit without waiting for it to be sent. Safe to call from any thread."""
+        self.emit_many(event, [data], to, room, skip_sid, namespace, callback, ignore_queue)
+
+    def emit_many(self, event, datas: list, to=None, room=None, skip_sid=None, namespace=None, callback=None, ignore_queue=False):
+        """Queues an emit of event for each item of datas. They are handed to the loop together
+        and sent in order."""
+        kwargs = {
+            "to": to,
+            "room": room,
+            "skip_sid": skip_sid,
+            "namespace": namespace,
+            "callback": callback,
+            "ignore_queue": ignore_queue
+        }
+
+        queued = time.perf_counter()
+        self.__enqueue([(queued, event, data, kwargs) for data in datas])
+
+    def emit_stats(self) -> dict:
+        """Returns the amount of emits sent, and the mean and max seconds between queueing and sending them."""
+        with self.stats_lock:
+            return {
+                "emitted": self.emitted,
+                "mean_latency": self.emit_latency_total / self.emitted if self.emitted else 0,
+                "max_latency": self.emit_latency_max,
+                "queued": self.emit_queue.qsize() if self.emit_queue else sum(len(batch) for batch in self.pending_emits)
+            }
 
     def sleep(self, seconds=0):
-        return asyncio.run(super().sleep(seconds))
+        """Sleeps the calling thread. Should not be called from the event loop."""
+        time.sleep(seconds)
@@ -0,0 +1,256 @@
+from __future__ import annotations
+from collections import OrderedDict
+from logging import Logger, LoggerAdapter
+from pathlib import Path
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from usbipice.utils.compression import is_compressed, decompress_to
+
+# uploads without a chunk for this long are abandoned
+UPLOAD_TIMEOUT_SECONDS = 300
+
+class BitstreamStoreLogger(LoggerAdapter):
+    def __init__(self, logger, extra=None):
+        super().__init__(logger, extra)
+
+    def process(self, msg, kwargs):
+        return f"[BitstreamStore] {msg}", kwargs
+
+class HashingWriter:
+    """File wrapper that hashes what is written to it."""
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha256()
+
+    def write(self, data: bytes):
+        self.hash.update(data)
+        return self.f.write(data)
+
+class Upload:
+    """Bitstream that is being received a chunk at a time."""
+    def __init__(self, batch: str, size: int, f, path: str):
+        self.batch = batch
+        self.size = size
+        self.received = 0
+        self.writer = HashingWriter(f)
+        self.path = path
+        self.last_chunk = time.monotonic()
+
+class BitstreamStore:
+    """Stores bitstreams on disk by their sha256, so that identical bitstreams are uploaded and
+    written once per worker. Once the store holds more than max_bytes, the least recently used
+    bitstreams are removed. Bitstreams acquired by a device are not removed until released."""
+    def __init__(self, path: Path, max_bytes: int, logger: Logger):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.logger = BitstreamStoreLogger(logger)
+
+        self.lock = threading.Lock()
+        # digest -> size, least recently used first
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        # digest -> amount of acquires that have not been released
+        self.pins: dict[str, int] = {}
+        # digest -> upload in progress, whose size is reserved
+        self.uploads: dict[str, Upload] = {}
+        self.reserved = 0
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.__load()
+
+    def __load(self):
+        """Indexes bitstreams left by a previous run, oldest first."""
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.startswith("."):
+                # partial upload
+                os.remove(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        with self.lock:
+            for _, name, size in sorted(files):
+                self.entries[name] = size
+                self.size += size
+
+            self.__evict()
+
+        self.logger.info(f"loaded {len(self.entries)} bitstreams, {self.size} bytes")
+
+    def __file(self, digest: str) -> Path:
+        return self.path.joinpath(digest)
+
+    def __evict(self):
+        """Should be called with the lock held."""
+        for digest in list(self.entries):
+            if self.size + self.reserved <= self.max_bytes:
+                return
+
+            if self.pins.get(digest):
+                continue
+
+            self.size -= self.entries.pop(digest)
+
+            try:
+                os.remove(self.__file(digest))
+            except FileNotFoundError:
+                pass
+
+    def missing(self, hashes: list[str]) -> list[str]:
+        """Returns the hashes that are not stored. Stored ones are marked as recently used."""
+        out = []
+        with self.lock:
+            for digest in hashes:
+                if digest in self.entries:
+                    self.entries.move_to_end(digest)
+                else:
+                    out.append(digest)
+
+        return out
+
+    def uploading(self, digest: str) -> bool:
+        with self.lock:
+            return digest in self.uploads
+
+    def receive(self, batch: str, digest: str, size: int, offset: int, data) -> bool:
+        """Writes a chunk of a bitstream that is size bytes long, data is bytes or compressed bytes.
+        Chunks have to arrive in order. Space for the whole bitstream is reserved on the first chunk, the
+        upload fails if it does not fit next to the pinned bitstreams. Returns True once the bitstream is
+        stored, False if the upload failed and None while chunks are missing or another batch is
+        uploading the same bitstream."""
+        if not isinstance(digest, str) or len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            self.logger.error(f"bad bitstream digest {digest}")
+            return False
+
+        with self.lock:
+            if digest in self.entries:
+                self.entries.move_to_end(digest)
+                return True
+
+            upload = self.uploads.get(digest)
+
+            if upload and upload.batch != batch:
+                return None
+
+            if not upload:
+                if offset != 0:
+                    self.logger.error(f"upload of {digest} did not start at offset 0")
+                    return False
+
+                self.__expire()
+
+                self.reserved += size
+                self.__evict()
+
+                if size > self.max_bytes or self.size + self.reserved > self.max_bytes:
+                    self.reserved -= size
+                    self.logger.error(f"no space for bitstream {digest} of {size} bytes")
+                    return False
+
+                fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".")
+                upload = Upload(batch, size, os.fdopen(fd, "wb"), tmp)
+                self.uploads[digest] = upload
+
+        # only one batch writes to an upload, chunks of a batch arrive one at a time
+        try:
+            if offset != upload.received:
+                raise ValueError(f"chunk at offset {offset}, expected {upload.received}")
+
+            if is_compressed(data):
+                written = decompress_to(data, upload.writer, max_size=upload.size - upload.received)
+            elif isinstance(data, bytes):
+                if len(data) > upload.size - upload.received:
+                    raise ValueError("more data than the declared size")
+                written = upload.writer.write(data)
+            else:
+                raise ValueError("not bytes")
+
+            upload.received += written
+            upload.last_chunk = time.monotonic()
+
+            if upload.received < upload.size:
+                return None
+
+            upload.writer.f.close()
+
+            if upload.writer.hash.hexdigest() != digest:
+                raise ValueError("content does not match digest")
+
+            os.replace(upload.path, self.__file(digest))
+        except Exception as e:
+            self.logger.error(f"failed to receive bitstream {digest}: {e}")
+            with self.lock:
+                self.__abandon(digest)
+            return False
+
+        with self.lock:
+            del self.uploads[digest]
+            self.reserved -= upload.size
+
+            if digest not in self.entries:
+                self.entries[digest] = upload.size
+                self.size += upload.size
+
+            self.__evict()
+
+        return True
+
+    def __abandon(self, digest: str):
+        """Should be called with the lock held."""
+        upload = self.uploads.pop(digest, None)
+        if not upload:
+            return
+
+        self.reserved -= upload.size
+
+        try:
+            upload.writer.f.close()
+            os.remove(upload.path)
+        except Exception:
+            pass
+
+    def __expire(self):
+        """Should be called with the lock held."""
+        now = time.monotonic()
+        for digest, upload in list(self.uploads.items()):
+            if now - upload.last_chunk > UPLOAD_TIMEOUT_SECONDS:
+                self.logger.warning(f"abandoning upload of {digest}")
+                self.__abandon(digest)
+
+    def acquire(self, digest: str) -> Path:
+        """Returns the path of a stored bitstream, which is kept until release is called. Returns
+        None if it is not stored."""
+        with self.lock:
+            if digest not in self.entries:
+                return None
+
+            self.entries.move_to_end(digest)
+            self.pins[digest] = self.pins.get(digest, 0) + 1
+
+            return self.__file(digest)
+
+    def release(self, digest: str):
+        with self.lock:
+            if digest not in self.pins:
+                return
+
+            self.pins[digest] -= 1
+            if not self.pins[digest]:
+                del self.pins[digest]
+
+            self.__evict()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "bitstreams": len(self.entries),
+                "bytes": self.size,
+                "pinned": len(self.pins),
+                "uploading": len(self.uploads),
+                "reserved": self.reserved
+            }
@@ -30,6 +30,7 @@ class Config:
         self.control_server_url: str = config_else_env("USBIPICE_CONTROL_SERVER", "Connection", parser, error=False)
         if not self.control_server_url:
             print("WARNING: not logging to control")
+        self.heartbeat_seconds: int = int(config_else_env("USBIPICE_HEARTBEAT_SECONDS", "Connection", parser, default="5"))
         self.virtual_ip: str = config_else_env("USBIPICE_VIRTUAL_IP", "Connection", parser, error=False)
         if not self.virtual_ip:
             self.virtual_ip = get_ip()
@@ -42,3 +43,9 @@ class Config:
 
         self.default_firmware_path = config_else_env("USBIPICE_DEFAULT", "Firmware", parser)
         self.pulse_firmware_path = config_else_env("USBIPICE_PULSE_COUNT", "Firmware", parser)
+
+        self.device_threads: int = int(config_else_env("USBIPICE_DEVICE_THREADS", "Devices", parser, default="32"))
+        self.bringup_concurrency: int = int(config_else_env("USBIPICE_BRINGUP_CONCURRENCY", "Devices", parser, default="16"))
+        self.bringup_per_hub: int = int(config_else_env("USBIPICE_BRINGUP_PER_HUB", "Devices", parser, default="4"))
+
+        self.bitstream_store_bytes: int = int(config_else_env("USBIPICE_BITSTREAM_STORE_BYTES", "Storage", parser, default=str(1024 ** 3)))
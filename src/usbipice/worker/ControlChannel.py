@@ -0,0 +1,73 @@
+from __future__ import annotations
+from logging import Logger, LoggerAdapter
+import threading
+
+import socketio
+
+import typing
+if typing.TYPE_CHECKING:
+    from usbipice.worker import Config
+    from usbipice.worker.device import DeviceManager
+
+class ControlChannelLogger(LoggerAdapter):
+    def __init__(self, logger, extra=None):
+        super().__init__(logger, extra)
+
+    def process(self, msg, kwargs):
+        return f"[ControlChannel] {msg}", kwargs
+
+class ControlChannel:
+    """Keeps a socket open to the control server and pushes a heartbeat with the device count
+    and queue depth every config.heartbeat_seconds. The control treats a dropped socket as a
+    possible worker failure, so it notices a dead worker without polling it."""
+    def __init__(self, manager: DeviceManager, config: Config, logger: Logger):
+        self.manager = manager
+        self.config = config
+        self.logger = ControlChannelLogger(logger)
+
+        # reconnects are done by the heartbeat loop
+        self.sio = socketio.Client(reconnection=False)
+        self.stopped = threading.Event()
+        self.thread = None
+
+        @self.sio.event
+        def connect():
+            self.logger.info("connected to control")
+
+        @self.sio.event
+        def disconnect(reason):
+            self.logger.warning(f"disconnected from control: {reason}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, daemon=True, name="control-channel")
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+    def __heartbeat(self):
+        if not self.sio.connected:
+            try:
+                self.sio.connect(self.config.control_server_url, auth={"worker": self.config.worker_name}, wait_timeout=10)
+            except Exception as e:
+                self.logger.warning(f"failed to connect to control: {e}")
+                return
+
+        self.sio.emit("worker heartbeat", {
+            "devices": self.manager.deviceCount(),
+            "queue": self.manager.queueDepth()
+        })
+
+    def __run(self):
+        while not self.stopped.is_set():
+            try:
+                self.__heartbeat()
+            except Exception as e:
+                self.logger.error(f"failed to send heartbeat: {e}")
+
+            self.stopped.wait(self.config.heartbeat_seconds)
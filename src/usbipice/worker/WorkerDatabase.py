@@ -1,8 +1,7 @@
 from __future__ import annotations
 from logging import LoggerAdapter
 from importlib.metadata import version
-
-import psycopg
+import threading
 
 from usbipice.utils import Database
 from usbipice.worker.device.state.reservable import get_registered_reservables
@@ -19,19 +18,29 @@ class WorkerDataBaseLogger(LoggerAdapter):
     def process(self, msg, kwargs):
         return f"[WorkerDatabase] {msg}", kwargs
 
+# pending status updates are written together after this delay
+STATUS_FLUSH_SECONDS = 0.005
+
 # TODO use __execute
 class WorkerDatabase(Database):
-    """Provides access to database operations related to the worker process."""
+    """Provides access to database operations related to the worker process. Device status
+    updates are queued and written in batches by a background thread. Only the latest
+    status of a device is written if it changes multiple times between flushes."""
     def __init__(self, config: Config, logger):
         super().__init__(config.libpg_string)
         self.worker_name = config.worker_name
         self.logger = WorkerDataBaseLogger(logger)
 
+        self.pending_statuses: dict[str, DeviceState] = {}
+        self.status_lock = threading.Lock()
+        # serialises flushes so that an older batch cannot be written after a newer one
+        self.flush_lock = threading.Lock()
+
         usbipice_version = version("usbipice")
         reservables = get_registered_reservables()
 
         try:
-            with psycopg.connect(self.url) as conn:
+            with self.pool.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute("CALL addWorker(%s::varchar(255), %s::varchar(255), %s::int, %s::varchar(255), %s::varchar(255)[])", (self.worker_name, config.virtual_ip, config.virtual_server_port, usbipice_version, reservables))
                     conn.commit()
@@ -44,7 +53,7 @@ class WorkerDatabase(Database):
     def addDevice(self, deviceserial: str) -> bool:
         """Add a device to the database."""
         try:
-            with psycopg.connect(self.url) as conn:
+            with self.pool.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute("CALL addDevice(%s::varchar(255), %s::varchar(255))", (deviceserial, self.worker_name))
                     conn.commit()
@@ -54,10 +63,44 @@ class WorkerDatabase(Database):
 
         return True
 
-    def updateDeviceStatus(self, deviceserial: str, status: DeviceState) -> bool:
-        """Updates the status field of a device."""
+    def addDevices(self, deviceserials: list[str]) -> bool:
+        """Adds multiple devices to the database in one transaction."""
+        if not deviceserials:
+            return True
+
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("CALL addDevices(%s::varchar(255)[], %s::varchar(255))", (deviceserials, self.worker_name))
+                    conn.commit()
+        except Exception:
+            self.logger.error(f"failed to add devices {deviceserials}")
+            return False
+
+        return True
+
+    def updateDeviceStatuses(self, statuses: dict[str, DeviceState]) -> bool:
+        """Updates the status field of multiple devices, given as serial -> status, in one transaction."""
+        if not statuses:
+            return True
+
+        serials = list(statuses.keys())
+        states = list(statuses.values())
+
         try:
-            with psycopg.connect(self.url) as conn:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("CALL updateDeviceStatuses(%s::varchar(255)[], %s::DeviceState[])", (serials, states))
+                    conn.commit()
+        except Exception:
+            self.logger.error(f"failed to update device statuses {statuses}")
+            return False
+
+        return True
+
+    def __updateDeviceStatus(self, deviceserial: str, status: DeviceState) -> bool:
+        try:
+            with self.pool.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute("CALL updateDeviceStatus(%s::varchar(255), %s::DeviceState)", (deviceserial, status))
                     conn.commit()
@@ -65,10 +108,45 @@ class WorkerDatabase(Database):
             self.logger.error(f"failed to update device {deviceserial} to status {status}")
             return False
 
+        return True
+
+    def updateDeviceStatus(self, deviceserial: str, status: DeviceState) -> bool:
+        """Queues an update to the status field of a device. The update is written
+        within STATUS_FLUSH_SECONDS, use flushDeviceStatuses to wait for it."""
+        with self.status_lock:
+            start = not self.pending_statuses
+            self.pending_statuses[deviceserial] = status
+
+        if start:
+            timer = threading.Timer(STATUS_FLUSH_SECONDS, self.flushDeviceStatuses)
+            timer.daemon = True
+            timer.name = "worker-database-status-flush"
+            timer.start()
+
+        return True
+
+    def flushDeviceStatuses(self) -> bool:
+        """Writes all queued status updates. If the batch fails, the updates are retried
+        one at a time so that a single bad device does not drop the others."""
+        with self.flush_lock:
+            with self.status_lock:
+                statuses, self.pending_statuses = self.pending_statuses, {}
+
+            if self.updateDeviceStatuses(statuses):
+                return True
+
+            success = True
+            for serial, status in statuses.items():
+                success = self.__updateDeviceStatus(serial, status) and success
+
+            return success
+
     def onExit(self):
         """Removes the worker and all related devices from the database."""
+        self.flushDeviceStatuses()
+
         try:
-            with psycopg.connect(self.url) as conn:
+            with self.pool.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute("SELECT * FROM removeWorker(%s::varchar(255))", (self.worker_name,))
                     data = cur.fetchall()
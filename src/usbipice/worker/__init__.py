@@ -1,3 +1,5 @@
 from usbipice.worker.WorkerDatabase import WorkerDatabase
 from usbipice.worker.Config import Config
+from usbipice.worker.BitstreamStore import BitstreamStore
+from usbipice.worker.ControlChannel import ControlChannel
 from usbipice.worker import app, test
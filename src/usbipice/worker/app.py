@@ -5,19 +5,19 @@ import sys
 import threading
 import json
 
-from flask import Flask, Response
+from flask import Flask, Response, jsonify
 from flask_socketio import SocketIO
 from socketio import ASGIApp
 from asgiref.wsgi import WsgiToAsgi
 
-from usbipice.worker import Config, WorkerDatabase
+from usbipice.worker import Config, WorkerDatabase, ControlChannel
 from usbipice.worker.device import DeviceManager
 
 from usbipice.utils import EventSender
 from usbipice.utils import RemoteLogger
 from usbipice.utils.web import SyncAsyncServer, flask_socketio_adapter_connect, flask_socketio_adapter_on, inject_and_return_json
 
-# 100 bitstreams
+# 100 bitstreams, large batches are streamed with batch chunk events instead
 MAX_REQUEST_SIZE = 104.2 * 8000 * 100
 
 def create_app(app: Flask, socketio: SocketIO | SyncAsyncServer, config: Config, logger: logging.Logger):
@@ -25,6 +25,12 @@ def create_app(app: Flask, socketio: SocketIO | SyncAsyncServer, config: Config,
     event_sender = EventSender(socketio, config.libpg_string, logger)
     database = WorkerDatabase(config, logger)
     manager = DeviceManager(event_sender, database, config, logger)
+    # reservations of devices on other workers are not routed
+    event_sender.start(owns=manager.hasDevice)
+
+    if config.control_server_url:
+        channel = ControlChannel(manager, config, logger)
+        channel.start()
 
     sock_id_to_client_id = {}
     id_lock = threading.Lock()
@@ -33,16 +39,42 @@ def create_app(app: Flask, socketio: SocketIO | SyncAsyncServer, config: Config,
     def heartbeat():
         return Response(status=200)
 
+    @app.get("/stats")
+    def stats():
+        stats = {
+            "events": event_sender.queueStats()
+        }
+
+        if isinstance(socketio, SyncAsyncServer):
+            stats["emits"] = socketio.emit_stats()
+
+        return jsonify(stats)
+
     @app.get("/reserve")
     @inject_and_return_json
-    def reserve(serial: str, kind: str, args: dict):
-        return manager.reserve(serial, kind, args)
+    def reserve(serial: str, kind: str, args: dict, name: str=None):
+        return manager.reserve(serial, kind, args, name)
 
     @app.get("/unreserve")
     @inject_and_return_json
     def devices_bus(serial: str):
         return manager.unreserve(serial)
 
+    @app.get("/reservebatch")
+    @inject_and_return_json
+    def reserve_batch(serials: list, kind: str, args: dict, name: str=None):
+        return manager.reserveBatch(serials, kind, args, name)
+
+    @app.get("/unreservebatch")
+    @inject_and_return_json
+    def unreserve_batch(serials: list):
+        return manager.unreserveBatch(serials)
+
+    @app.get("/missingbitstreams")
+    @inject_and_return_json
+    def missing_bitstreams(hashes: list):
+        return manager.store.missing(hashes)
+
     @socketio.on("connect")
     @flask_socketio_adapter_connect
     def connection(sid, environ, auth):
@@ -54,7 +86,11 @@ def create_app(app: Flask, socketio: SocketIO | SyncAsyncServer, config: Config,
         with id_lock:
             sock_id_to_client_id[sid] = client_id
 
-        event_sender.addSocket(sid, client_id)
+        event_sender.addSocket(sid, client_id, bool(auth.get("batch")), auth.get("resume"))
+
+        # tells the client that it may send compressed bytes
+        if "zlib" in (auth.get("compression") or []):
+            socketio.emit("compression", "zlib", to=sid)
 
     @socketio.on("disconnect")
     @flask_socketio_adapter_on
@@ -68,6 +104,18 @@ def create_app(app: Flask, socketio: SocketIO | SyncAsyncServer, config: Config,
 
         event_sender.removeSocket(client_id)
 
+    @socketio.on("ack")
+    @flask_socketio_adapter_on
+    def ack(sid, seq):
+        with id_lock:
+            client_id = sock_id_to_client_id.get(sid)
+
+        if not client_id or not isinstance(seq, int):
+            logger.warning("bad event acknowledgement")
+            return
+
+        event_sender.ack(client_id, seq)
+
     @socketio.on("request")
     @flask_socketio_adapter_on
     def handle(sid, data):
@@ -78,27 +126,104 @@ def create_app(app: Flask, socketio: SocketIO | SyncAsyncServer, config: Config,
             logger.warning("socket sent request but has no known client id")
             return
 
-        try:
-            data = json.loads(data)
-        except Exception:
-            logger.error(f"failed to load json string from client {client_id}")
+        # older clients send a json string, newer ones send the packet directly so that
+        # bytes travel as binary attachments
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except Exception:
+                logger.error(f"failed to load json string from client {client_id}")
+                return
+
+        if not isinstance(data, dict):
+            logger.error(f"bad request packet from client {client_id}")
             return
 
         serial = data.get("serial")
         event = data.get("event")
         contents = data.get("contents")
 
-        if not serial or not event or not contents:
+        if not serial or not event or not contents or not isinstance(contents, dict):
             logger.error(f"bad request packet from client {client_id}")
             return
 
-        if isinstance(serial, list):
-            for s in serial:
-                thread = threading.Thread(target=lambda : manager.handleRequest(s, event, contents), name="socket-request")
-                thread.start()
+        if not isinstance(serial, list):
+            serial = [serial]
+
+        for s in serial:
+            manager.handleRequest(s, event, contents)
+
+    @socketio.on("batch chunk")
+    @flask_socketio_adapter_on
+    def batch_chunk(sid, data):
+        with id_lock:
+            client_id = sock_id_to_client_id.get(sid)
+
+        if not client_id:
+            logger.warning("socket sent batch chunk but has no known client id")
+            return
+
+        try:
+            serials = data["serial"]
+            batch = data["batch"]
+            name = data["name"]
+            digest = data["digest"]
+            size = data["size"]
+            offset = data.get("offset", 0)
+
+            if not isinstance(serials, list) or not isinstance(digest, str) or not isinstance(size, int) \
+                    or not isinstance(offset, int) or size <= 0:
+                raise ValueError
+        except Exception:
+            logger.error(f"bad batch chunk from client {client_id}")
+            return
+
+        manager.handleBatchChunk(serials, str(batch), str(name), digest, size, offset, data.get("data"))
+
+    @socketio.on("batch commit")
+    @flask_socketio_adapter_on
+    def batch_commit(sid, data):
+        with id_lock:
+            client_id = sock_id_to_client_id.get(sid)
+
+        if not client_id:
+            logger.warning("socket sent batch commit but has no known client id")
+            return
+
+        try:
+            serials = data["serial"]
+            batch = data["batch"]
+            count = data["count"]
+
+            if not isinstance(serials, list) or not isinstance(count, int):
+                raise ValueError
+        except Exception:
+            logger.error(f"bad batch commit from client {client_id}")
+            return
+
+        manager.handleBatchCommit(serials, str(batch), count)
+
+    @socketio.on("batch abort")
+    @flask_socketio_adapter_on
+    def batch_abort(sid, data):
+        with id_lock:
+            client_id = sock_id_to_client_id.get(sid)
+
+        if not client_id:
+            logger.warning("socket sent batch abort but has no known client id")
+            return
+
+        try:
+            serials = data["serial"]
+            batch = data["batch"]
+
+            if not isinstance(serials, list):
+                raise ValueError
+        except Exception:
+            logger.error(f"bad batch abort from client {client_id}")
+            return
 
-        else:
-            manager.handleRequest(serial, event, contents)
+        manager.handleBatchAbort(serials, str(batch))
 
     return manager
 
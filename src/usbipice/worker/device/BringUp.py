@@ -0,0 +1,142 @@
+from __future__ import annotations
+from collections import deque
+from logging import Logger, LoggerAdapter
+import threading
+import time
+
+from usbipice.worker.device.state.core import ReadyState, BrokenState
+
+import typing
+if typing.TYPE_CHECKING:
+    from usbipice.worker.device import Device
+    from usbipice.worker.device.state.core import AbstractState
+
+# flashing times out after 60 seconds and testing after 30
+BRINGUP_TIMEOUT_SECONDS = 180
+
+class BringUpLogger(LoggerAdapter):
+    def __init__(self, logger, extra=None):
+        super().__init__(logger, extra)
+
+    def process(self, msg, kwargs):
+        return f"[BringUp] {msg}", kwargs
+
+class BringUp:
+    """Flashes and tests newly found devices. At most max_concurrent devices are brought up at
+    once, and at most per_hub devices behind the same USB hub, since devices that reboot into
+    the bootloader at the same time reenumerate the hub. A device is brought up until it reaches
+    the ready or broken state. Devices that take longer than timeout seconds, or whose bring up
+    fails, give up their slot so that the devices behind them are not held up."""
+    def __init__(self, max_concurrent: int, per_hub: int, logger: Logger, timeout: float=BRINGUP_TIMEOUT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.per_hub = per_hub
+        self.timeout = timeout
+        self.logger = BringUpLogger(logger)
+
+        self.lock = threading.Lock()
+        self.pending: deque[tuple[Device, str]] = deque()
+        # serial -> (hub, start time, deadline timer)
+        self.active: dict[str, tuple[str, float, threading.Timer]] = {}
+        self.hubs: dict[str, int] = {}
+
+        self.started_at = None
+        self.total = 0
+        self.ready = 0
+        self.broken = 0
+        self.failed = 0
+
+    def add(self, device: Device, hub: str):
+        """Queues device to be brought up, hub identifies the USB hub it is plugged into."""
+        with self.lock:
+            if not self.active and not self.pending:
+                self.started_at = time.monotonic()
+                self.total = self.ready = self.broken = self.failed = 0
+
+            self.pending.append((device, hub))
+            self.total += 1
+
+        self.__startNext()
+
+    def __startNext(self):
+        started = []
+
+        with self.lock:
+            for device, hub in list(self.pending):
+                if len(self.active) >= self.max_concurrent:
+                    break
+
+                if self.hubs.get(hub, 0) >= self.per_hub:
+                    continue
+
+                self.pending.remove((device, hub))
+
+                timer = threading.Timer(self.timeout, self.__finish, args=(device.serial, "timed out"))
+                timer.daemon = True
+                timer.name = f"{device.serial}-bringup-timeout"
+
+                self.active[device.serial] = (hub, time.monotonic(), timer)
+                self.hubs[hub] = self.hubs.get(hub, 0) + 1
+                started.append((device, timer))
+
+        for device, timer in started:
+            timer.start()
+            future = device.post(device.bringUp)
+            future.add_done_callback(lambda future, serial=device.serial : future.exception() and self.__finish(serial, "failed"))
+
+    def stateChanged(self, serial: str, state: AbstractState):
+        """Called when a device switches states, ends its bring up once it is ready or broken."""
+        if isinstance(state, ReadyState):
+            self.__finish(serial, "ready")
+        elif isinstance(state, BrokenState):
+            self.__finish(serial, "broken")
+
+    def __finish(self, serial: str, outcome: str):
+        """Ends the bring up of serial, outcome is ready, broken, failed or timed out."""
+        with self.lock:
+            entry = self.active.pop(serial, None)
+
+            if not entry:
+                return
+
+            hub, started_at, timer = entry
+            timer.cancel()
+
+            self.hubs[hub] -= 1
+            if not self.hubs[hub]:
+                del self.hubs[hub]
+
+            if outcome == "ready":
+                self.ready += 1
+            elif outcome == "broken":
+                self.broken += 1
+            else:
+                self.failed += 1
+
+            done = self.ready + self.broken + self.failed
+            total = self.total
+            ready = self.ready
+            broken = self.broken
+            failed = self.failed
+            elapsed = time.monotonic() - self.started_at
+            finished = not self.active and not self.pending
+
+        message = f"{serial} {outcome} after {time.monotonic() - started_at:.1f}s, {done}/{total} devices done in {elapsed:.1f}s"
+        if outcome in ("ready", "broken"):
+            self.logger.info(message)
+        else:
+            self.logger.warning(message)
+
+        if finished:
+            self.logger.info(f"brought up {total} devices in {elapsed:.1f}s, {ready} ready, {broken} broken, {failed} failed")
+
+        self.__startNext()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "pending": len(self.pending),
+                "active": len(self.active),
+                "ready": self.ready,
+                "broken": self.broken,
+                "failed": self.failed
+            }
@@ -1,6 +1,7 @@
 from __future__ import annotations
 from pathlib import Path
 from logging import Logger, LoggerAdapter
+from concurrent.futures import Future
 import threading
 
 from usbipice.worker.device import DeviceEventSender
@@ -9,8 +10,8 @@ from usbipice.worker.device.state.reservable import get_reservation_state_fac
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from usbipice.worker import WorkerDatabase, Config, EventSender
-    from usbipice.worker.device import DeviceManager
+    from usbipice.worker import WorkerDatabase, Config, EventSender, BitstreamStore
+    from usbipice.worker.device import DeviceManager, UsbMonitor
     from usbipice.worker.device.state.core import AbstractState
 
 # TODO add this to config
@@ -39,6 +40,8 @@ class Device:
         self.path.joinpath("mount").mkdir(parents=True, exist_ok=True)
         self.path.joinpath("media").mkdir(exist_ok=True)
 
+    def bringUp(self):
+        """Flashes the default firmware and tests the device."""
         self.__flashDefault()
 
     def __flashDefault(self):
@@ -80,11 +83,24 @@ class Device:
         with self._device_lock:
             self._device.handleRequest(event, json)
 
+    def post(self, fn, *args) -> Future:
+        """Queues fn(*args) on the mailbox of the device, which runs messages one at a time in the
+        order they were posted."""
+        return self.manager.mailboxes.post(self.serial, fn, *args)
+
     def handleExit(self):
         with self._device_lock:
             if self._device:
                 self._device.handleExit()
 
+    def queueDepth(self) -> int:
+        # not locked, a state that is switching should not hold up heartbeats
+        device = self._device
+        if not device:
+            return 0
+
+        return device.queueDepth()
+
     def switch(self, state_factory):
         with self._device_lock:
             if self._device:
@@ -93,6 +109,8 @@ class Device:
             self._device = device
             self._device.start()
 
+        self.manager.bringup.stateChanged(self.serial, device)
+
     @property
     def config(self) -> Config:
         return self.manager.config
@@ -104,3 +122,16 @@ class Device:
     @property
     def media_path(self) -> Path:
         return self.path.joinpath("media")
+
+    @property
+    def devs(self) -> list[dict]:
+        """Udev properties of the dev files of the device."""
+        return self.manager.index.get(self.serial)
+
+    @property
+    def usb_monitor(self) -> UsbMonitor:
+        return self.manager.usb_monitor
+
+    @property
+    def store(self) -> BitstreamStore:
+        return self.manager.store
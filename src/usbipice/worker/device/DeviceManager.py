@@ -1,12 +1,17 @@
 from __future__ import annotations
 from logging import Logger, LoggerAdapter
+from pathlib import Path
 import threading
 import atexit
+from concurrent.futures import Future
 
 import pyudev
 
 from usbipice.utils.dev import *
-from usbipice.worker.device import Device
+from usbipice.utils import DeviceIndex
+from usbipice.worker.BitstreamStore import BitstreamStore
+from usbipice.worker.device import Device, MailboxExecutor, BringUp, UsbMonitor
+from usbipice.worker.device.Device import WORKER_MEDIA
 
 import typing
 if typing.TYPE_CHECKING:
@@ -21,7 +26,8 @@ class ManagerLogger(LoggerAdapter):
 
 class DeviceManager:
     """Tracks device events and routes them to their corresponding Device object. Also listens to kernel
-    device events to identify usbip disconnects."""
+    device events to identify usbip disconnects. Device events and requests are posted to the mailbox of
+    the device, which handles them one at a time in order on a shared pool of threads."""
     def __init__(self, event_sender: EventSender, database: WorkerDatabase, config: Config, logger: Logger):
         self.config: Config = config
         self.logger: Logger = ManagerLogger(logger)
@@ -32,6 +38,19 @@ class DeviceManager:
 
         self._devs: dict[str, Device] = {}
         self._dev_lock = threading.Lock()
+        self.mailboxes = MailboxExecutor(config.device_threads, logger, "device")
+        self.bringup = BringUp(config.bringup_concurrency, config.bringup_per_hub, logger)
+        # dev files by serial, seeded by scan and updated with udev events
+        self.index = DeviceIndex()
+        # kernel USB events, used by states to detect usbip disconnects
+        self.usb_monitor = UsbMonitor(logger)
+
+        # shared by the devices so that identical bitstreams are stored once
+        self.store = BitstreamStore(Path(WORKER_MEDIA).joinpath("store"), config.bitstream_store_bytes, logger)
+        # digest -> (serials, batch, name) to queue once the digest is uploaded, chunks of a digest
+        # are received one at a time on its mailbox
+        self._waiting: dict[str, list[tuple[list[str], str, str]]] = {}
+        self._upload_lock = threading.Lock()
 
         self.exiting: bool = False
 
@@ -46,14 +65,40 @@ class DeviceManager:
         self.scan()
 
     def scan(self):
-        """Trigger add events for devices that are already connected."""
+        """Registers devices that are already connected with the database in a single batch, then
+        brings them up concurrently. Add events are triggered for devices that were already known."""
         self.logger.info("Scanning for devices")
-        context = pyudev.Context().list_devices()
+        devs = [dev for dev in pyudev.Context().list_devices() if dev.properties.get("ID_VENDOR_ID") in ["2e8a", "1209"]]
+        self.index.seed(devs)
 
-        for dev in context:
-            self.handleDevEvent("add", dev)
+        # serial -> hub
+        hubs = {}
+        for dev in devs:
+            serial = get_serial(dict(dev))
+            if serial and serial not in hubs:
+                hubs[serial] = get_hub(dev)
+
+        new_devices = []
+        with self._dev_lock:
+            new_serials = [serial for serial in hubs if serial not in self._devs]
 
-        self.logger.info("Finished scan")
+            if self.database.addDevices(new_serials):
+                for serial in new_serials:
+                    device = Device(serial, self, self.event_sender, self.database, self.logger)
+                    self._devs[serial] = device
+                    new_devices.append(device)
+
+        self.logger.info(f"Finished scan, registered {len(new_devices)} devices")
+
+        # bring up looks at the current dev files of the device itself
+        for device in new_devices:
+            self.bringup.add(device, hubs[device.serial])
+
+        # devices that failed to register in the batch are registered one at a time
+        registered = {device.serial for device in new_devices}
+        for dev in devs:
+            if get_serial(dict(dev)) not in registered:
+                self.handleDevEvent("add", dev)
 
     def handleDevEvent(self, action: str, dev: pyudev.Device):
         """Ensures that a device is related to pico2ice and reroutes the event to handleAddDevice or
@@ -64,13 +109,16 @@ class DeviceManager:
         if dev.properties.get("ID_VENDOR_ID") not in ["2e8a", "1209"]:
             return
 
+        hub = get_hub(dev) if action == "add" else None
         dev = dict(dev)
 
-        serial = get_serial(dev)
+        # updated before the event is posted, so that the device sees its current dev files
+        serial = self.index.handleEvent(action, dev) or get_serial(dev)
 
         if not serial:
             return
 
+        new = False
         with self._dev_lock:
             device = self._devs.get(serial)
 
@@ -78,38 +126,145 @@ class DeviceManager:
                 self.database.addDevice(serial)
                 device = Device(serial, self, self.event_sender, self.database, self.logger)
                 self._devs[serial] = device
+                new = True
+
+        if new:
+            self.bringup.add(device, hub)
+            return
 
-        thread = threading.Thread(target=lambda : device.handleDeviceEvent(action, dev), name="dev-event-handler")
-        thread.start()
+        device.post(device.handleDeviceEvent, action, dev)
 
-    def handleRequest(self, serial: str, event: str, contents: dict):
+    def handleRequest(self, serial: str, event: str, contents: dict) -> Future:
+        """Queues a client request on the device, returns None if it does not exist."""
         with self._dev_lock:
             dev = self._devs.get(serial)
 
         if not dev:
             self.logger.warning(f"request for {event} on {serial} but device not found")
+            return None
+
+        return dev.post(dev.handleRequest, event, contents)
+
+    def __dispatch(self, serials: list[str], event: str, contents: dict):
+        for serial in serials:
+            self.handleRequest(serial, event, contents)
+
+    def handleBatchChunk(self, serials: list[str], batch: str, name: str, digest: str, size: int, offset: int, data=None):
+        """Receives a chunk of bitstream name in batch. Once the bitstream is stored, it is queued on serials
+        with an 'evaluate batch' request. Chunks without data refer to bitstreams that are already stored
+        or being uploaded. Chunks are written on the mailbox of their digest, so that the chunks of a
+        bitstream are written in order without blocking the caller."""
+        self.mailboxes.post(f"upload {digest}", self.__receiveChunk, serials, batch, name, digest, size, offset, data)
+
+    def __receiveChunk(self, serials: list[str], batch: str, name: str, digest: str, size: int, offset: int, data):
+        if offset == 0 or data is None:
+            with self._upload_lock:
+                self._waiting.setdefault(digest, []).append((serials, batch, name))
+
+        if data is None:
+            done = not self.store.uploading(digest)
+        else:
+            done = self.store.receive(batch, digest, size, offset, data) is not None
+
+        if not done:
             return
 
-        return dev.handleRequest(event, contents)
+        # a bitstream that failed to upload is still queued, the devices report it as missing
+        with self._upload_lock:
+            waiting = self._waiting.pop(digest, [])
+
+        for waiting_serials, waiting_batch, waiting_name in waiting:
+            self.__dispatch(waiting_serials, "evaluate batch", {
+                "batch": waiting_batch,
+                "bitstreams": {waiting_name: digest}
+            })
 
-    def reserve(self, serial: str, kind: str, args: dict):
+    def handleBatchCommit(self, serials: list[str], batch: str, count: int):
+        """Marks that count bitstreams were sent in batch, devices send results once they are evaluated."""
+        self.__dispatch(serials, "evaluate commit", {"batch": batch, "count": count})
+
+    def handleBatchAbort(self, serials: list[str], batch: str):
+        """Drops a batch that the client failed to send, devices send the results of what they received."""
+        with self._upload_lock:
+            for digest, waiting in list(self._waiting.items()):
+                waiting = [entry for entry in waiting if entry[1] != batch]
+
+                if waiting:
+                    self._waiting[digest] = waiting
+                else:
+                    del self._waiting[digest]
+
+        self.__dispatch(serials, "evaluate abort", {"batch": batch})
+
+    def __postReserve(self, serial: str, kind: str, args: dict, client_id: str=None) -> Future:
         with self._dev_lock:
             device = self._devs.get(serial)
 
         if not device:
             self.logger.error(f"device {serial} reserved but does not exist")
+            return None
+
+        if client_id:
+            self.event_sender.setRoute(serial, client_id)
+
+        return device.post(device.handleReserve, kind, args)
+
+    def __postUnreserve(self, serial: str) -> Future:
+        with self._dev_lock:
+            device = self._devs.get(serial)
+
+        if not device:
+            return None
+
+        def unreserve():
+            res = device.handleUnreserve()
+            self.event_sender.clearRoute(serial)
+            return res
+
+        return device.post(unreserve)
+
+    def __result(self, future: Future):
+        """Waits for a posted message, returns False if it was not posted or failed."""
+        if not future:
+            return False
+
+        try:
+            return future.result()
+        except Exception:
             return False
 
-        return device.handleReserve(kind, args)
+    def reserve(self, serial: str, kind: str, args: dict, client_id: str=None):
+        """Switches serial to the reservable state kind. If client_id is given, events
+        from the device are routed to it without a database lookup."""
+        return self.__result(self.__postReserve(serial, kind, args, client_id))
 
     def unreserve(self, serial: str):
+        return self.__result(self.__postUnreserve(serial))
+
+    def reserveBatch(self, serials: list[str], kind: str, args: dict, client_id: str=None) -> list[str]:
+        """Reserves multiple devices concurrently, returns the serials that were reserved."""
+        futures = [self.__postReserve(serial, kind, args, client_id) for serial in serials]
+        return [serial for serial, future in zip(serials, futures) if self.__result(future)]
+
+    def unreserveBatch(self, serials: list[str]) -> list[str]:
+        """Unreserves multiple devices concurrently, returns the serials that were unreserved."""
+        futures = [self.__postUnreserve(serial) for serial in serials]
+        return [serial for serial, future in zip(serials, futures) if self.__result(future)]
+
+    def hasDevice(self, serial: str) -> bool:
         with self._dev_lock:
-            dev = self._devs.get(serial)
+            return serial in self._devs
 
-        if not dev:
-            return False
+    def deviceCount(self) -> int:
+        with self._dev_lock:
+            return len(self._devs)
+
+    def queueDepth(self) -> int:
+        """Total amount of client work waiting on devices."""
+        with self._dev_lock:
+            devs = list(self._devs.values())
 
-        return dev.handleUnreserve()
+        return sum(dev.queueDepth() for dev in devs)
 
     def onExit(self):
         """Callback for cleanup on program exit"""
@@ -119,4 +274,5 @@ class DeviceManager:
         for dev in devs:
             dev.handleExit()
 
+        self.usb_monitor.stop()
         self.database.onExit()
@@ -0,0 +1,68 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from logging import Logger, LoggerAdapter
+import threading
+
+# messages handled before a mailbox gives up its thread to other mailboxes
+MAILBOX_BATCH = 16
+
+class MailboxLogger(LoggerAdapter):
+    def __init__(self, logger, extra=None):
+        super().__init__(logger, extra)
+
+    def process(self, msg, kwargs):
+        return f"[MailboxExecutor] {msg}", kwargs
+
+class MailboxExecutor:
+    """Runs messages on a bounded pool of threads. Each key has a mailbox, messages posted to the
+    same mailbox run one at a time in the order they were posted, while different mailboxes run
+    concurrently."""
+    def __init__(self, max_workers: int, logger: Logger, name: str="mailbox"):
+        self.logger = MailboxLogger(logger)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+        self.lock = threading.Lock()
+        # key -> messages that have not run, only keys with a scheduled drain are present
+        self.mailboxes: dict[str, deque] = {}
+
+    def post(self, key: str, fn, *args) -> Future:
+        """Queues fn(*args) on the mailbox of key. Returns a future for the result."""
+        future = Future()
+
+        with self.lock:
+            mailbox = self.mailboxes.get(key)
+
+            if mailbox is not None:
+                mailbox.append((fn, args, future))
+                return future
+
+            self.mailboxes[key] = deque([(fn, args, future)])
+
+        self.executor.submit(self.__drain, key)
+        return future
+
+    def __drain(self, key: str):
+        for _ in range(MAILBOX_BATCH):
+            with self.lock:
+                mailbox = self.mailboxes[key]
+
+                if not mailbox:
+                    del self.mailboxes[key]
+                    return
+
+                fn, args, future = mailbox.popleft()
+
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                self.logger.exception(f"message for {key} failed: {e}")
+                future.set_exception(e)
+
+        # requeued behind other mailboxes so that a busy one does not hold the thread
+        self.executor.submit(self.__drain, key)
+
+    def depth(self) -> int:
+        """Amount of messages waiting to run."""
+        with self.lock:
+            return sum(len(mailbox) for mailbox in self.mailboxes.values())
@@ -0,0 +1,82 @@
+from __future__ import annotations
+from logging import Logger, LoggerAdapter
+import threading
+
+import pyudev
+
+from usbipice.utils.dev import get_busid
+
+class UsbMonitorLogger(LoggerAdapter):
+    def __init__(self, logger, extra=None):
+        super().__init__(logger, extra)
+
+    def process(self, msg, kwargs):
+        return f"[UsbMonitor] {msg}", kwargs
+
+class UsbMonitor:
+    """Kernel monitor of USB devices shared by the worker. Remove events are dispatched to the
+    callback subscribed to their busid. The monitor starts with the first subscription."""
+    def __init__(self, logger: Logger):
+        self.logger = UsbMonitorLogger(logger)
+
+        self.lock = threading.Lock()
+        # busid -> callback(busid)
+        self.subscribers: dict[str, callable] = {}
+        self.observer: pyudev.MonitorObserver = None
+
+    def __start(self):
+        """Should be called with the lock held."""
+        if self.observer:
+            return
+
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context, source="kernel")
+        monitor.filter_by("usb", device_type="usb_device")
+
+        self.observer = pyudev.MonitorObserver(monitor, self.__handleEvent, name="usb-monitor")
+        self.observer.start()
+
+    def subscribe(self, busid: str, callback):
+        """Calls callback(busid) when the USB device on busid is removed. Replaces the previous
+        subscription for busid."""
+        with self.lock:
+            self.__start()
+            self.subscribers[busid] = callback
+
+    def unsubscribe(self, busid: str, callback=None):
+        """Removes the subscription for busid. If callback is given, the subscription is only removed if
+        it is still for callback."""
+        with self.lock:
+            if callback is None or self.subscribers.get(busid) == callback:
+                self.subscribers.pop(busid, None)
+
+    def __handleEvent(self, action: str, dev: pyudev.Device):
+        if action != "remove":
+            return
+
+        path = dev.get("DEVPATH")
+        if not path:
+            return
+
+        busid = get_busid(path)
+
+        if not busid:
+            self.logger.debug(f"failed to parse busid on kernel remove (devpath: {path})")
+            return
+
+        with self.lock:
+            callback = self.subscribers.get(busid)
+
+        if not callback:
+            return
+
+        try:
+            callback(busid)
+        except Exception as e:
+            self.logger.error(f"remove callback for bus {busid} failed: {e}")
+
+    def stop(self):
+        with self.lock:
+            if self.observer:
+                self.observer.stop()
+                self.observer = None
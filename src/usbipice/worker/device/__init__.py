@@ -1,3 +1,6 @@
 from usbipice.worker.device.DeviceEventSender import DeviceEventSender
+from usbipice.worker.device.MailboxExecutor import MailboxExecutor
+from usbipice.worker.device.UsbMonitor import UsbMonitor
 from usbipice.worker.device.Device import Device
+from usbipice.worker.device.BringUp import BringUp
 from usbipice.worker.device.DeviceManager import DeviceManager
@@ -80,6 +80,10 @@ class AbstractState:
     def handleExit(self):
         """Cleanup"""
 
+    def queueDepth(self) -> int:
+        """Amount of client work waiting on the device, reported in heartbeats."""
+        return 0
+
     def switch(self, state_factory):
         """Switches the Device's state to a new one. This happens by first calling
         exit on the existing state. After the existing state has exited, the
@@ -102,7 +106,7 @@ class AbstractState:
         using the handleEvent function with event=event. These arguments specify which json
         key should be used to get the value of that positional argument when handleEvent is called.
         The values passed in from the client are typechecked. Currently, only type and list[type]
-        are supported. Files should be sent as cp437 encoded bytes. If the file is needed later, it
+        are supported. Files should be sent as bytes, which travel as socket.io binary attachments. If the file is needed later, it
         should be saved under self.getDevice().getMediaPath(). Parameters without types are treated as Any.
 
         Ex.
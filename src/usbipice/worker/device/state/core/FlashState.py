@@ -2,7 +2,7 @@ import threading
 
 from usbipice.worker.device.state.core import AbstractState, BrokenState
 
-from usbipice.utils.dev import send_bootloader, upload_firmware_path, get_devs
+from usbipice.utils.dev import send_bootloader, upload_firmware_path
 
 class FlashState(AbstractState):
     def __init__(self, state, firmware_path, next_state_factory, timeout=None):
@@ -22,7 +22,7 @@ class FlashState(AbstractState):
             self.timer.start()
 
     def start(self):
-        devs = get_devs().get(self.serial)
+        devs = self.device.devs
         if not devs:
             return
 
@@ -2,7 +2,7 @@ from __future__ import annotations
 import threading
 import uuid
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import time
 import os
 
@@ -10,7 +10,7 @@ import serial
 
 from usbipice.worker.device.state.core import AbstractState, FlashState, BrokenState
 from usbipice.worker.device.state.reservable import reservable
-from usbipice.utils.dev import get_devs
+from usbipice.utils.compression import is_compressed, decompress_to
 
 import typing
 if typing.TYPE_CHECKING:
@@ -22,11 +22,29 @@ BAUD = 115200            # ignored by TinyUSB but needed by pyserial
 CHUNK_SIZE = 512         # bytes per write
 INTER_CHUNK_DELAY = 0.00001  # seconds
 BITSTREAM_SIZE = 0 #TODO
+# batches without a bitstream or commit for this long are dropped, same as the upload timeout of the store
+BATCH_TIMEOUT_SECONDS = 300
 
 @dataclass
 class Bitstream:
     location: str
     name: str
+    # set for bitstreams in the store, which are released after evaluation
+    digest: str = None
+    # set for bitstreams streamed in a batch
+    batch: str = None
+
+@dataclass
+class Batch:
+    """Bitstreams that are streamed to the device, results are held until all of them are evaluated."""
+    received: int = 0
+    # set on commit
+    expected: int = None
+    updated: float = field(default_factory=time.monotonic)
+
+    @property
+    def complete(self) -> bool:
+        return self.expected is not None and self.received >= self.expected
 
 @reservable("pulsecount")
 class PulseCountStateFlasher(AbstractState):
@@ -39,46 +57,83 @@ class PulseCountState(AbstractState):
 
         self.cv = threading.Condition()
         self.bitstream_queue: list[Bitstream] = []
-        # name -> pulses
+        # name -> pulses, of bitstreams sent with and without a batch
         self.results = {}
+        self.batch_results = {}
+        # batch id -> batch that has not been committed or fully received
+        self.batches: dict[str, Batch] = {}
+        self.evaluating: Bitstream = None
+
+        self.ser: serial.Serial = None
+        self.reader: Reader = None
+        self.sender = PulseCountEventSender(self.device_event_sender)
+
+        self.exiting = False
+        self.thread: threading.Thread = None
 
+    def start(self):
         # ensure new ports show correctly
         time.sleep(2)
 
         self.ser = self.connectSerial()
+        if not self.ser:
+            return
+
         self.reader = Reader(self.ser)
-        self.sender = PulseCountEventSender(self.device_event_sender)
 
-        self.exiting = False
         self.thread = threading.Thread(target=self.run)
         self.thread.start()
 
         self.device_event_sender.sendDeviceInitialized()
 
-    def connectSerial(self):
-        paths = get_devs().get(self.serial)
+    def connectSerial(self) -> serial.Serial:
+        """Opens the serial port of the device. Switches to BrokenState and returns None if it has none
+        or it fails to open."""
+        port = next((dev.get("DEVNAME") for dev in self.device.devs
+                     if dev.get("SUBSYSTEM") == "tty" and dev.get("ID_USB_INTERFACE_NUM") == "00"), None)
 
-        if not paths:
+        if not port:
+            self.logger.error("no serial port found")
             self.switch(lambda : BrokenState(self.device))
+            return None
 
-        port = list(filter(lambda x : x.get("ID_USB_INTERFACE_NUM") == "00", paths))
-
-        if not port:
+        try:
+            return serial.Serial(port, BAUD, timeout=0.1)
+        except serial.SerialException as e:
+            self.logger.error(f"failed to open serial port {port}: {e}")
             self.switch(lambda : BrokenState(self.device))
+            return None
 
-        port = port[0].get("DEVNAME")
-        return serial.Serial(port, BAUD, timeout=0.1)
 
+    def queueDepth(self):
+        with self.cv:
+            return len(self.bitstream_queue)
 
     @AbstractState.register("evaluate", "files")
     def queue(self, files):
+        """Queues files, which map names to bitstream bytes, optionally compressed. Bitstreams
+        sent as cp437 decoded strings by older clients are also accepted."""
         media_path = self.device.media_path
         paths = [str(media_path.joinpath(str(uuid.uuid4()))) for _ in range(len(files))]
 
         for path, data in zip(paths, files.values()):
-            with open(path, "wb") as f:
-                f.write(data.encode("cp437"))
-                f.flush()
+            try:
+                with open(path, "wb") as f:
+                    if is_compressed(data):
+                        decompress_to(data, f)
+                    elif isinstance(data, str):
+                        f.write(data.encode("cp437"))
+                    else:
+                        f.write(data)
+                    f.flush()
+            except Exception as e:
+                self.logger.error(f"failed to save bitstreams: {e}")
+
+                for path in paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+
+                return False
 
         self.logger.debug(f"queued bitstreams: {list(files.keys())}")
 
@@ -90,18 +145,132 @@ class PulseCountState(AbstractState):
 
         return True
 
+    def __acquire(self, batch: str, bitstreams: dict) -> list[Bitstream]:
+        """Acquires bitstreams from the store, which maps names to sha256 digests. If any are not
+        stored, none are acquired, a 'missing bitstreams' event is sent and None is returned."""
+        store = self.device.store
+        acquired = []
+
+        for name, digest in bitstreams.items():
+            path = store.acquire(digest)
+
+            if not path:
+                for bitstream in acquired:
+                    store.release(bitstream.digest)
+
+                missing = store.missing(list(bitstreams.values()))
+                self.logger.error(f"bitstreams not stored: {missing}")
+                self.sender.missing(missing)
+                return None
+
+            acquired.append(Bitstream(str(path), name, digest, batch))
+
+        return acquired
+
+    @AbstractState.register("evaluate batch", "batch", "bitstreams")
+    def queueBatch(self, batch, bitstreams):
+        """Queues stored bitstreams that were streamed as part of batch. Results are sent once the
+        batch is committed and all of its bitstreams are evaluated. Bitstreams that are not stored
+        still count towards the batch, they are reported with a 'missing bitstreams' event."""
+        if not isinstance(bitstreams, dict):
+            return False
+
+        acquired = self.__acquire(batch, bitstreams)
+
+        with self.cv:
+            entry = self.batches.setdefault(batch, Batch())
+            entry.received += len(bitstreams)
+            entry.updated = time.monotonic()
+
+            if acquired:
+                self.bitstream_queue.extend(acquired)
+                self.cv.notify_all()
+
+            self.__closeBatch(batch)
+
+        return acquired is not None
+
+    @AbstractState.register("evaluate commit", "batch", "count")
+    def commitBatch(self, batch, count: int):
+        """Marks that count bitstreams were sent in batch. Bitstreams of the batch may still arrive
+        after the commit."""
+        with self.cv:
+            entry = self.batches.setdefault(batch, Batch())
+            entry.expected = count
+            entry.updated = time.monotonic()
+            self.__closeBatch(batch)
+
+        return True
+
+    @AbstractState.register("evaluate abort", "batch")
+    def abortBatch(self, batch):
+        """Stops waiting for the rest of batch, which the client failed to send. Bitstreams of the
+        batch that were received are still evaluated."""
+        with self.cv:
+            if self.batches.pop(batch, None):
+                self.logger.warning(f"batch {batch} aborted")
+                self.__sendResults()
+
+        return True
+
+    def __closeBatch(self, batch):
+        """Should be called with cv held."""
+        if self.batches[batch].complete:
+            del self.batches[batch]
+            self.__sendResults()
+
+    def __expireBatches(self):
+        """Should be called with cv held."""
+        now = time.monotonic()
+        for batch, entry in list(self.batches.items()):
+            if now - entry.updated > BATCH_TIMEOUT_SECONDS:
+                self.logger.warning(f"batch {batch} timed out with {entry.received} bitstreams received")
+                del self.batches[batch]
+
+    def __sendResults(self):
+        """Sends the results of bitstreams sent without a batch once none of them are left to
+        evaluate, and the results of batches once every batch is complete and evaluated. Should
+        be called with cv held."""
+        self.__expireBatches()
+
+        busy = self.bitstream_queue + ([self.evaluating] if self.evaluating else [])
+
+        if self.results and not any(bitstream.batch is None for bitstream in busy):
+            if not self.sender.finished(self.results):
+                self.logger.error("failed to send results")
+
+            self.results = {}
+
+        if self.batch_results and not self.batches and not any(bitstream.batch for bitstream in busy):
+            if not self.sender.finished(self.batch_results):
+                self.logger.error("failed to send results")
+
+            self.batch_results = {}
+
+    def __remove(self, bitstream: Bitstream):
+        if bitstream.digest:
+            self.device.store.release(bitstream.digest)
+        else:
+            os.remove(bitstream.location)
+
     def run(self):
         time.sleep(2)
 
         while not self.exiting:
             with self.cv:
                 if not self.bitstream_queue:
-                    self.cv.wait_for(lambda : self.bitstream_queue or self.exiting)
+                    self.cv.wait_for(lambda : self.bitstream_queue or self.exiting, timeout=BATCH_TIMEOUT_SECONDS / 10)
 
                 if self.exiting:
                     return
 
+                if not self.bitstream_queue:
+                    # results held by batches that were never completed
+                    self.__sendResults()
+                    continue
+
                 bitstream = self.bitstream_queue.pop()
+                self.evaluating = bitstream
 
             self.logger.debug(f"evaluating bitstream {bitstream.name}")
 
@@ -129,25 +298,36 @@ class PulseCountState(AbstractState):
             if result is False:
                 with self.cv:
                     self.bitstream_queue.append(bitstream)
+                    self.evaluating = None
                     continue
 
-            self.results[bitstream.name] = result
-            os.remove(bitstream.location)
+            self.__remove(bitstream)
 
             with self.cv:
-                if not self.bitstream_queue:
-                    if not self.sender.finished(self.results):
-                        self.logger.error("failed to send results")
-
-                    self.results = {}
+                results = self.batch_results if bitstream.batch else self.results
+                results[bitstream.name] = result
+                self.evaluating = None
+                self.__sendResults()
 
     def handleExit(self):
         self.exiting = True
         with self.cv:
             self.cv.notify_all()
-        self.thread.join()
-        self.reader.exit()
-        self.ser.close()
+
+        if self.thread:
+            self.thread.join()
+
+        with self.cv:
+            for bitstream in self.bitstream_queue:
+                if bitstream.digest:
+                    self.device.store.release(bitstream.digest)
+            self.bitstream_queue = []
+
+        if self.reader:
+            self.reader.exit()
+
+        if self.ser:
+            self.ser.close()
 
 class Reader:
     def __init__(self, port: serial.Serial):
@@ -212,3 +392,9 @@ class PulseCountEventSender:
             "event": "results",
             "results": pulses
         })
+
+    def missing(self, hashes):
+        return self.event_sender.sendDeviceEvent({
+            "event": "missing bitstreams",
+            "hashes": hashes
+        })
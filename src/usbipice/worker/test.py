@@ -69,6 +69,9 @@ class FakeDevice:
     def __iter__(self):
         return zip(self.properties.keys(), self.properties.values())
 
+    def find_parent(self, subsystem, device_type=None):
+        return None
+
 class FakeEventSender(DeviceEventSender):
     def __init__(self, event_sender, serial, logger):
         super().__init__(event_sender, serial, logger)
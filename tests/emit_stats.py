@@ -0,0 +1,67 @@
+"""Checks the emit stats reported by SyncAsyncServer. Serves a SyncAsyncServer with uvicorn, emits
+events to a connected client while the event loop is held up, and verifies the amount of emits,
+their latency and the queue depth that are reported.
+    python3 tests/emit_stats.py
+"""
+import threading
+import time
+
+import socketio
+import uvicorn
+
+from usbipice.utils.web import SyncAsyncServer
+
+PORT = 8099
+EMITS = 50
+# seconds the event loop is blocked, emits queued meanwhile wait at least this long
+BLOCK_SECONDS = 0.2
+
+server = SyncAsyncServer(async_mode="asgi")
+connected = threading.Event()
+
+@server.on("connect")
+def connect(sid, environ, auth):
+    connected.set()
+
+uvicorn_server = uvicorn.Server(uvicorn.Config(socketio.ASGIApp(server), port=PORT, log_level="error"))
+threading.Thread(target=uvicorn_server.run, daemon=True).start()
+
+# emits made before the loop is known are held until it is, this one is sent before the client connects
+server.emit("ping", -1)
+stats = server.emit_stats()
+assert stats["emitted"] == 0 and stats["queued"] == 1, stats
+
+received = []
+done = threading.Event()
+client = socketio.Client()
+
+@client.on("ping")
+def ping(i):
+    received.append(i)
+    if len(received) == EMITS:
+        done.set()
+
+for _ in range(50):
+    try:
+        client.connect(f"http://127.0.0.1:{PORT}")
+        break
+    except Exception:
+        time.sleep(0.1)
+
+assert connected.wait(5), "client did not connect"
+
+server.loop.call_soon_threadsafe(time.sleep, BLOCK_SECONDS)
+for i in range(EMITS):
+    server.emit("ping", i)
+
+assert done.wait(5) and received == list(range(EMITS)), received
+stats = server.emit_stats()
+
+assert stats["emitted"] == EMITS + 1, stats
+assert stats["queued"] == 0, stats
+assert stats["max_latency"] >= BLOCK_SECONDS, stats
+assert 0 < stats["mean_latency"] <= stats["max_latency"], stats
+
+client.disconnect()
+uvicorn_server.should_exit = True
+print(f"emit stats ok: {stats}")
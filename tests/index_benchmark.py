@@ -0,0 +1,145 @@
+"""Loads a large fleet into the database configured by USBIPICE_DATABASE and reports the plan and
+timing of the statements behind the frequently called reservation and heartbeat functions, first
+without and then with the indexes from V1.7. The indexes are dropped inside a transaction that is
+rolled back, so the database is left unchanged. Most devices are reserved, as on a busy farm. Workers
+are created under the 'benchmark-index' prefix and removed afterwards. The migrations must already
+be applied.
+    python3 tests/index_benchmark.py --workers 100 --devices 100 --available 0.05 --runs 200
+"""
+import argparse
+import os
+import statistics
+import time
+
+from usbipice.utils import Database
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--workers", type=int, default=100, help="amount of fake workers")
+parser.add_argument("--devices", type=int, default=100, help="devices per worker")
+parser.add_argument("--available", type=float, default=0.05, help="fraction of devices that are available")
+parser.add_argument("--runs", type=int, default=200, help="executions timed per statement")
+parser.add_argument("--plans", action="store_true", help="print full plans")
+args = parser.parse_args()
+
+DATABASE_URL = os.environ.get("USBIPICE_DATABASE")
+if not DATABASE_URL:
+    raise Exception("USBIPICE_DATABASE not configured")
+
+WORKER_PREFIX = "benchmark-index-worker"
+KIND = "benchmark"
+
+INDEXES = ["ReservationsUntil", "ReservationsClientName", "DeviceWorker", "DeviceAvailable", "WorkerReservables"]
+
+SERIAL = f"{WORKER_PREFIX}-0-{args.devices - 1}"
+CLIENT = "benchmark-index-client-7"
+WORKER = f"{WORKER_PREFIX}-{args.workers // 2}"
+
+STATEMENTS = [
+    ("handleReservationTimeouts",
+     "SELECT Device FROM Reservations WHERE Until < CURRENT_TIMESTAMP", ()),
+    ("getReservationsEndingSoon",
+     "SELECT Device FROM Reservations WHERE Until < CURRENT_TIMESTAMP + interval '1 second' * %s", (60,)),
+    ("makeReservations candidates",
+     """SELECT Device.SerialID, Device.Worker, count(*) OVER (PARTITION BY Device.Worker)
+        FROM Device
+        INNER JOIN Worker ON Worker.WorkerName = Device.Worker
+        WHERE DeviceStatus = 'available' AND Worker.Reservables @> ARRAY[%s]::varchar(255)[]""", (KIND,)),
+    ("getDeviceCallBack existence check (NOT IN, before V1.7)",
+     "SELECT %s::varchar(255) NOT IN (SELECT SerialId FROM Device)", (SERIAL,)),
+    ("getDeviceCallBack existence check (NOT EXISTS)",
+     "SELECT NOT EXISTS (SELECT 1 FROM Device WHERE SerialId = %s::varchar(255))", (SERIAL,)),
+    ("endAllReservations",
+     "SELECT Device FROM Reservations WHERE ClientName = %s::varchar(255)", (CLIENT,)),
+    ("worker devices",
+     "SELECT SerialId FROM Device WHERE Worker = %s::varchar(255)", (WORKER,)),
+]
+
+database = Database(DATABASE_URL)
+
+def setup():
+    with database.pool.connection() as conn:
+        # half of the workers offer another kind, so the reservable filter has something to skip
+        conn.execute("""
+            INSERT INTO Worker(WorkerName, Host, ServerPort, LastHeartbeat, UsbipiceVersion, Reservables, ShuttingDown)
+            SELECT %s || '-' || w, '127.0.0.1', 9, CURRENT_TIMESTAMP, 'benchmark',
+                CASE WHEN w %% 2 = 0 THEN ARRAY[%s, 'pulsecount'] ELSE ARRAY['other'] END::varchar(255)[], false
+            FROM generate_series(0, %s - 1) AS w
+        """, (WORKER_PREFIX, KIND, args.workers))
+
+        conn.execute("""
+            INSERT INTO Device(SerialId, Worker, DeviceStatus)
+            SELECT %s || '-' || w || '-' || d, %s || '-' || w,
+                CASE WHEN random() < %s THEN 'available' ELSE 'reserved' END::DeviceState
+            FROM generate_series(0, %s - 1) AS w, generate_series(0, %s - 1) AS d
+        """, (WORKER_PREFIX, WORKER_PREFIX, args.available, args.workers, args.devices))
+
+        # reservations end over the next hour, a few have already timed out
+        conn.execute("""
+            INSERT INTO Reservations(Device, ClientName, Until)
+            SELECT SerialId, 'benchmark-index-client-' || (row_number() OVER () %% 500),
+                LOCALTIMESTAMP + interval '1 minute' * (random() * 65 - 5)
+            FROM Device
+            WHERE Worker LIKE %s AND DeviceStatus = 'reserved'
+        """, (f"{WORKER_PREFIX}-%",))
+
+        conn.execute("ANALYZE Worker")
+        conn.execute("ANALYZE Device")
+        conn.execute("ANALYZE Reservations")
+
+def teardown():
+    database.proc("DELETE FROM Worker WHERE WorkerName LIKE %s", (f"{WORKER_PREFIX}-%",))
+
+def measure(cur, sql, params):
+    cur.execute(f"EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF, SUMMARY OFF) {sql}", params)
+    plan = [row[0] for row in cur.fetchall()]
+
+    timings = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        timings.append(time.perf_counter() - start)
+
+    return plan, statistics.median(timings)
+
+def run(drop_indexes: bool) -> dict:
+    out = {}
+    with database.pool.connection() as conn:
+        with conn.transaction(force_rollback=True):
+            with conn.cursor() as cur:
+                if drop_indexes:
+                    for index in INDEXES:
+                        cur.execute(f"DROP INDEX {index}")
+
+                for name, sql, params in STATEMENTS:
+                    out[name] = measure(cur, sql, params)
+
+    return out
+
+def scans(plan: list[str]) -> str:
+    nodes = [line.strip().lstrip("-> ").split("  ")[0] for line in plan if "Scan" in line]
+    return "; ".join(nodes)
+
+teardown()
+setup()
+
+try:
+    before = run(drop_indexes=True)
+    after = run(drop_indexes=False)
+finally:
+    teardown()
+
+print(f"{args.workers} workers, {args.workers * args.devices} devices, {args.available:.0%} available, median of {args.runs} runs")
+for name, _, _ in STATEMENTS:
+    before_plan, before_time = before[name]
+    after_plan, after_time = after[name]
+
+    print(f"\n{name}")
+    print(f"  before: {before_time * 1000:.3f}ms  {scans(before_plan)}")
+    print(f"  after:  {after_time * 1000:.3f}ms  {scans(after_plan)}")
+
+    if args.plans:
+        print("  before plan:")
+        print("\n".join(f"    {line}" for line in before_plan))
+        print("  after plan:")
+        print("\n".join(f"    {line}" for line in after_plan))
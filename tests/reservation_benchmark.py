@@ -0,0 +1,89 @@
+"""Fires concurrent Control.reserve calls against the database configured by USBIPICE_DATABASE
+and reports latency percentiles and how many devices were handed to more than one reservation.
+Workers and devices are created under the 'benchmark' reservable and removed afterwards. The
+migrations must already be applied. Worker notifications are sent to a closed port and fail
+immediately. No socket server is attached, so client events are only queued.
+    python3 tests/reservation_benchmark.py --workers 8 --devices 64 --clients 300 --amount 2
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--workers", type=int, default=8, help="amount of fake workers")
+parser.add_argument("--devices", type=int, default=64, help="available devices per worker")
+parser.add_argument("--clients", type=int, default=300, help="amount of concurrent reserve calls")
+parser.add_argument("--amount", type=int, default=2, help="devices requested per reserve call")
+parser.add_argument("--pool", type=int, default=32, help="maximum database connections")
+args = parser.parse_args()
+
+# must be set before the pool is created
+os.environ["USBIPICE_DATABASE_POOL_MAX"] = str(args.pool)
+
+from usbipice.control import Control, ControlEventSender
+
+DATABASE_URL = os.environ.get("USBIPICE_DATABASE")
+if not DATABASE_URL:
+    raise Exception("USBIPICE_DATABASE not configured")
+
+WORKER_PREFIX = "benchmark-worker"
+KIND = "benchmark"
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+logger.addHandler(logging.StreamHandler(sys.stdout))
+
+control = Control(ControlEventSender(None, DATABASE_URL, logger), DATABASE_URL, logger)
+database = control.database
+
+def setup():
+    for i in range(args.workers):
+        name = f"{WORKER_PREFIX}-{i}"
+        database.proc("CALL addWorker(%s::varchar(255), %s::varchar(255), %s::int, %s::varchar(255), %s::varchar(255)[])",
+                      (name, "127.0.0.1", 9, "benchmark", [KIND]))
+
+        for j in range(args.devices):
+            serial = f"{name}-{j}"
+            database.proc("CALL addDevice(%s::varchar(255), %s::varchar(255))", (serial, name))
+            database.proc("CALL updateDeviceStatus(%s::varchar(255), %s::DeviceState)", (serial, "available"))
+
+def teardown():
+    database.proc("DELETE FROM Worker WHERE WorkerName LIKE %s", (f"{WORKER_PREFIX}-%",))
+
+def reserve(i):
+    start = time.perf_counter()
+    res = control.reserve(f"benchmark-client-{i}", args.amount, KIND, {})
+    return time.perf_counter() - start, res
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+teardown()
+setup()
+
+try:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        results = list(executor.map(reserve, range(args.clients)))
+    elapsed = time.perf_counter() - start
+finally:
+    teardown()
+
+latencies = [latency for latency, _ in results]
+failed = sum(1 for _, res in results if res is False)
+serials = Counter(row["serial"] for _, res in results if res for row in res)
+double_allocations = sum(count - 1 for count in serials.values() if count > 1)
+requested = min(args.clients * args.amount, args.workers * args.devices)
+
+print(f"Reserve calls: {args.clients} x {args.amount} devices, {args.workers * args.devices} available")
+print(f"Total time: {elapsed:.3f}s")
+print(f"p50 latency: {percentile(latencies, 0.50) * 1000:.1f}ms")
+print(f"p99 latency: {percentile(latencies, 0.99) * 1000:.1f}ms")
+print(f"Failed calls: {failed}")
+print(f"Devices allocated: {sum(serials.values())} of {requested} possible")
+print(f"Double allocations: {double_allocations}")